@@ -1,15 +1,31 @@
 # backend/app.py
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-import shutil
+from typing import List
+from collections import namedtuple, deque
+import asyncio
+import contextlib
+import hashlib
+import threading
 import uuid
+import json
 import os
 
 from .omr.processor import OMRProcessor
+from .omr.overlay import render_overlay, FORMATS, MEDIA_TYPES
+from .omr.utils import load_image
+from .omr.phash import PHashIndex, MAX_DISTANCE, from_hex
+from .omr.scoring import OPTION_LETTERS, compile_key
+from .jobs import JobManager
+from .cache import LRUCache
+from . import export
 from .db.database import engine, Base
-from .db import models
+from .db import models, database, crud, migrate, rescore, schemas
+from .db.writer import ResultWriter
+from .db.packing import PACKED_COLUMNS
 
 app = FastAPI(title="Automated OMR Evaluation API with Sample Data Support")
 
@@ -25,6 +41,14 @@ app.add_middleware(
 BASE_DIR = os.path.dirname(__file__)
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+# keep a copy of every original upload in UPLOAD_DIR (written after the response)
+ARCHIVE_UPLOADS = os.environ.get("OMR_ARCHIVE_UPLOADS", "1") != "0"
+# overlays are rendered on first request to /overlay; these are the defaults
+OVERLAY_FORMAT = os.environ.get("OMR_OVERLAY_FORMAT", "png")
+OVERLAY_QUALITY = int(os.environ.get("OMR_OVERLAY_QUALITY", "85"))
+OVERLAY_MAX_DIM = int(os.environ.get("OMR_OVERLAY_MAX_DIM", "0"))
+# sheets of the same exam whose perceptual hashes are this close are flagged as rescans
+RESCAN_MAX_DISTANCE = int(os.environ.get("OMR_RESCAN_MAX_DISTANCE", str(MAX_DISTANCE)))
 
 # assume sample_data folder is at project_root/sample_data
 PROJECT_ROOT = os.path.abspath(os.path.join(BASE_DIR, os.pardir))
@@ -32,68 +56,697 @@ SAMPLE_DATA_DIR = os.path.join(PROJECT_ROOT, "sample_data")
 ANSWER_KEYS_PATH = os.path.join(SAMPLE_DATA_DIR, "answer_keys.json")
 
 processor = OMRProcessor(answer_key_path=ANSWER_KEYS_PATH)
+jobs = JobManager()
+# results are written in batches by a background thread (OMR_WRITE_BATCH / OMR_WRITE_DELAY)
+writer = ResultWriter()
+# (content hash, version, processor revision) -> stored response, see _find_duplicate
+results_cache = LRUCache()
+# exam id -> PHashIndex of that exam's stored sheets, see _rescan_index
+rescan_indexes = {}
+_rescan_lock = threading.Lock()
+# exam code -> Exam.id
+_exam_ids = {}
+
+# an upload held in memory; archive_path/overlay_path are None when archiving
+# is disabled (the overlay is rendered from the archived original).
+# content_hash is the sha256 of the bytes, filled in off the event loop by
+# _hash_upload (or _spool_upload); None when the upload must not be deduplicated.
+Upload = namedtuple("Upload", ["uid", "filename", "data", "archive_path", "overlay_path", "content_hash"])
+# read size when hashing / archiving spooled uploads
+UPLOAD_CHUNK = 1024 * 1024
+
+def _upload_paths(filename):
+    """A fresh uuid for an upload and its archive and overlay paths (None when not archiving)."""
+    uid = str(uuid.uuid4())
+    if not ARCHIVE_UPLOADS:
+        return uid, None, None
+    file_ext = os.path.splitext(filename or "")[1].lower()
+    return uid, os.path.join(UPLOAD_DIR, f"{uid}{file_ext}"), os.path.join(UPLOAD_DIR, f"{uid}_overlay.png")
+
+async def _read_upload(file: UploadFile):
+    """Read an upload (spooled by starlette) into memory under a fresh uuid; not hashed yet."""
+    data = await file.read()
+    uid, archive_path, overlay_path = _upload_paths(file.filename)
+    return Upload(uid, file.filename, data, archive_path, overlay_path, None)
+
+def _hash_upload(upload: Upload):
+    """upload with its content_hash set; blocking (~1 ms per MB), so run it on a worker thread."""
+    return upload._replace(content_hash=hashlib.sha256(upload.data).hexdigest())
+
+def _spool_upload(file: UploadFile):
+    """
+    Upload for a spooled form file without holding its bytes: the file is
+    read once in chunks to hash it and copy it to the archive, and data is
+    left None (see _upload_data). Blocking; call it off the event loop.
+    """
+    uid, archive_path, overlay_path = _upload_paths(file.filename)
+    digest = hashlib.sha256()
+    file.file.seek(0)
+    with open(archive_path, "wb") if archive_path else contextlib.nullcontext() as archive:
+        for chunk in iter(lambda: file.file.read(UPLOAD_CHUNK), b""):
+            digest.update(chunk)
+            if archive is not None:
+                archive.write(chunk)
+    return Upload(uid, file.filename, None, archive_path, overlay_path, digest.hexdigest())
+
+def _upload_data(file: UploadFile):
+    """The bytes of a spooled form file, read when its sheet is about to be graded."""
+    file.file.seek(0)
+    return file.file.read()
+
+def _archive_upload(upload: Upload):
+    """Background task: persist the original upload bytes."""
+    if upload.archive_path:
+        with open(upload.archive_path, "wb") as f:
+            f.write(upload.data)
+
+def _save_overlay_spec(upload: Upload, spec):
+    """Keep what /overlay needs to render this sheet's overlay later."""
+    if upload.overlay_path:
+        spec_path = os.path.splitext(upload.overlay_path)[0] + ".json"
+        with open(spec_path, "w") as f:
+            json.dump(dict(spec, source=upload.archive_path), f)
+
+def _result_payload(res, student_identifier=None):
+    """API response payload for a stored Result row."""
+    if student_identifier is None and res.student is not None:
+        student_identifier = res.student.student_id
+    return {
+        "result_id": res.id,
+        "student_id": student_identifier,
+        "version": res.version,
+        "total_score": res.total_score,
+        "section_scores": res.section_scores,
+        "answers": res.raw_answers,
+        "overlay_path": res.overlay_path,
+    }
+
+def _find_duplicate(upload: Upload, version, template_rev):
+    """
+    Stored response for an earlier upload of the same bytes, graded for the
+    same version by a processor with the same revision; None if there is none.
+    Checks the in-process LRU first, then the results hash index, and records
+    a "deduplicated" audit entry against the original result.
+    """
+    if not upload.content_hash or not template_rev:
+        return None
+    cache_key = (upload.content_hash, version, template_rev)
+    payload = results_cache.get(cache_key)
+    db = database.SessionLocal()
+    try:
+        if payload is None:
+            res = crud.get_result_by_hash(db, upload.content_hash, version, template_rev)
+            if res is None:
+                return None
+            payload = _result_payload(res)
+            results_cache.put(cache_key, payload)
+    finally:
+        db.close()
+    writer.log(payload["result_id"], "deduplicated",
+               note=f"Re-upload of '{upload.filename}' answered from the stored result")
+    return dict(payload, deduplicated=True)
+
+def _rescan_index(db, exam_id):
+    """
+    The exam's perceptual-hash index, loaded on first use and topped up with
+    any results stored since (including by other processes).
+    """
+    with _rescan_lock:
+        index = rescan_indexes.setdefault(exam_id, PHashIndex())
+    for result_id, phash in crud.list_exam_phashes(db, exam_id, after_id=index.max_id):
+        index.add(result_id, from_hex(phash))
+    return index
+
+def _exam_id(db, exam_code):
+    exam_id = _exam_ids.get(exam_code)
+    if exam_id is None:
+        exam_id = _exam_ids[exam_code] = crud.get_or_create_exam(db, exam_code).id
+    return exam_id
+
+def _exam_answer_key(exam_code, version):
+    """
+    CompiledKey new sheets of an exam version are scored with when it isn't
+    the processor's: the key stored by a rescore. None without an exam_code
+    or a stored key. Read from the database on every call, so a rescore in
+    any process takes effect for the next sheet.
+    """
+    if not exam_code:
+        return None
+    db = database.SessionLocal()
+    try:
+        exam_id = _exam_ids.get(exam_code)
+        if exam_id is None:
+            exam = crud.get_exam_by_code(db, exam_code)
+            if exam is None:
+                return None
+            exam_id = exam.id
+        return _stored_answer_key(db, exam_id, version)
+    finally:
+        db.close()
+
+def _queue_result(result, upload: Upload, version, template_rev=None, exam_code=None):
+    """
+    Hand a processor result to the result writer and return a Future of the
+    API response payload, resolved once the batch it went into is committed.
+    With a template_rev, the upload's content hash is stored too so identical
+    re-uploads can be answered by _find_duplicate. With an exam_code, the
+    sheet is checked against that exam's earlier sheets: a near-identical one
+    is reported as possible_rescan_of and noted in the audit log.
+    """
+    _save_overlay_spec(upload, result["overlay"])
+    student_identifier = result.get("student_id") or upload.uid
+    content_hash = upload.content_hash if template_rev else None
+    phash = result.get("phash")
+    exam_id = None
+    index = None
+    rescan_of = None
+    if exam_code:
+        db = database.SessionLocal()
+        try:
+            exam_id = _exam_id(db, exam_code)
+            if phash:
+                index = _rescan_index(db, exam_id)
+                matches = index.query(from_hex(phash), RESCAN_MAX_DISTANCE)
+                rescan_of = matches[0] if matches else None
+        finally:
+            db.close()
+
+    audit = []
+    if rescan_of:
+        audit.append(("possible_rescan",
+                      f"Sheet is {rescan_of[1]} bits from result {rescan_of[0]}; likely the same paper rescanned"))
+    row = {
+        "student_identifier": student_identifier,
+        "uploaded_filename": upload.filename,
+        "uploaded_path": upload.archive_path,
+        "version": version,
+        "total_score": result["total_score"],
+        "section_scores": result["section_scores"],
+        "raw_answers": result["answers"],
+        "overlay_path": upload.overlay_path,
+        "content_hash": content_hash,
+        "template_rev": template_rev if content_hash else None,
+        "exam_id": exam_id,
+        "phash": phash,
+        "key_fingerprint": result.get("key_fingerprint"),
+        "audit": audit,
+    }
+
+    def stored(result_id):
+        payload = {
+            "result_id": result_id,
+            "student_id": student_identifier,
+            "version": version,
+            "total_score": result["total_score"],
+            "section_scores": result["section_scores"],
+            "answers": result["answers"],
+            "overlay_path": upload.overlay_path,
+        }
+        if index is not None:
+            index.add(result_id, from_hex(phash))
+        if content_hash:
+            results_cache.put((content_hash, version, template_rev), payload)
+        return dict(payload, deduplicated=False, possible_rescan_of=rescan_of[0] if rescan_of else None)
+
+    return writer.submit(row, then=stored)
+
+def _store_result(result, upload: Upload, version, template_rev=None, exam_code=None):
+    """Persist a processor result (see _queue_result) and return the API response payload."""
+    return _queue_result(result, upload, version, template_rev, exam_code).result()
+
+def _drain(pending, wait=False):
+    """
+    Yield NDJSON lines for (line, future) pairs at the front of pending whose
+    results have been written; with wait, block until all of them are. A None
+    future means the line is already complete (e.g. an error).
+    """
+    while pending and (wait or pending[0][1] is None or pending[0][1].done()):
+        line, future = pending.popleft()
+        if future is not None:
+            try:
+                line.update(future.result())
+            except Exception as e:
+                line["error"] = f"Could not store result: {e}"
+        yield json.dumps(line) + "\n"
+
+def _grade_upload(upload: Upload, version, student_id, exam_code=None):
+    """
+    Job body: answer from a stored result when these exact bytes were already
+    graded, otherwise run the OMR pipeline on the upload and persist the result.
+    Sheets of an exam with a corrected key (see rescore_exam) are scored with it.
+    """
+    answer_key = _exam_answer_key(exam_code, version)
+    template_rev = processor.revision(version, answer_key)
+    upload = _hash_upload(upload)
+    duplicate = _find_duplicate(upload, version, template_rev)
+    if duplicate is not None:
+        return duplicate
+    result = processor.process(upload.data, version=version, student_id=student_id, answer_key=answer_key)
+    return _store_result(result, upload, version, template_rev, exam_code)
+
+@app.on_event("startup")
+def init_database():
+    # schema setup is an explicit startup step, not an import side effect
+    database.init_db()
+    # convert rows stored before packed answers in the background; reads fall
+    # back to the legacy JSON until each row is done
+    if migrate.has_unpacked_results(database.engine):
+        threading.Thread(target=migrate.pack_results, args=(database.engine,),
+                         name="omr-pack-results", daemon=True).start()
+
+@app.on_event("shutdown")
+def shutdown_processor():
+    jobs.shutdown(wait=False)
+    processor.close()
+    writer.close()
 
 @app.post("/evaluate")
 async def evaluate_sheet(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     version: str = Form(...),
     student_id: str = Form(None),
+    exam_code: str = Form(None),
 ):
-    # save upload
-    file_ext = os.path.splitext(file.filename)[1].lower()
-    uid = str(uuid.uuid4())
-    saved_filename = f"{uid}{file_ext}"
-    out_path = os.path.join(UPLOAD_DIR, saved_filename)
-    with open(out_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    # grade straight from memory; the original is archived after the response
+    upload = await _read_upload(file)
+    background_tasks.add_task(_archive_upload, upload)
 
+    # grade on the job executor so the event loop stays free while we wait
+    job = jobs.submit(_grade_upload, upload, version, student_id, exam_code)
     try:
-        result = processor.process(out_path, version=version, student_id=student_id)
+        payload = await asyncio.wrap_future(job.future)
     except Exception as e:
         # optionally log the exception
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
 
-    # save to database
+    # Return also overlay image path so client (UI) can fetch or display; you may want to serve static files
+    return JSONResponse(status_code=200, content=payload)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    version: str = Form(...),
+    student_id: str = Form(None),
+    exam_code: str = Form(None),
+):
+    """Queue a sheet for grading and return its job id without waiting."""
+    upload = await _read_upload(file)
+    background_tasks.add_task(_archive_upload, upload)
+    job = jobs.submit(_grade_upload, upload, version, student_id, exam_code)
+    return {"job_id": job.id, "status": job.status}
+
+@app.get("/jobs/stats")
+def job_stats():
+    return jobs.stats()
+
+@app.get("/db/stats")
+def db_stats():
+    """Connection pool saturation per engine and the result writer's queue."""
+    return {"pools": database.get_pool_stats(), "writer": writer.stats()}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """
+    Job status and, once finished, its result or error. Pass `wait` (seconds)
+    to hold the request open until the job finishes or the wait runs out.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if wait > 0 and not job.future.done():
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job.future)), timeout=wait)
+        except Exception:
+            # timed out or failed; either way the job dict below says which
+            pass
+    return job.to_dict()
+
+@app.post("/evaluate/batch")
+async def evaluate_batch(
+    files: List[UploadFile] = File(...),
+    version: str = Form(...),
+    student_ids: List[str] = Form(None),
+    exam_code: str = Form(None),
+):
+    """
+    Grades many sheets on the processor's worker pool. The response is NDJSON:
+    one JSON object per line, written as each sheet finishes, tagged with the
+    `index` of the upload it belongs to. Failed sheets get an `error` field.
+    Sheets that were already graded are answered from the stored result.
+    Uploads stay in their spooled files: each one is hashed and archived in
+    chunks only when the worker pool has room for it, then read again to be
+    graded, so the first results don't wait for the whole batch.
+    """
+    def stream():
+        answer_key = _exam_answer_key(exam_code, version)
+        try:
+            template_rev = processor.revision(version, answer_key)
+        except ValueError:
+            # unknown version: no dedupe, every sheet reports the error below
+            template_rev = None
+        ids = list(student_ids or [])
+        # (upload index, Upload) of every sheet handed to the pool, by position
+        graded_uploads = []
+        # lines in response order; (line, None) is ready, else it waits for its write
+        queued = deque()
+
+        def sources():
+            # runs inside process_batch, one file at a time as the pool frees up
+            for idx, file in enumerate(files):
+                upload = _spool_upload(file)
+                duplicate = _find_duplicate(upload, version, template_rev)
+                if duplicate is not None:
+                    line = {"index": idx, "filename": upload.filename}
+                    line.update(duplicate)
+                    queued.append((line, None))
+                    continue
+                graded_uploads.append((idx, upload))
+                yield _upload_data(file)
+
+        # closing the results (client gone) cancels the sheets not yet started
+        with contextlib.closing(processor.process_batch(sources(), version=version,
+                                                        answer_key=answer_key)) as graded:
+            for res in graded:
+                idx, upload = graded_uploads[res["index"]]
+                if "error" in res:
+                    line = {"index": idx, "filename": upload.filename, "error": res["error"]}
+                    queued.append((line, None))
+                else:
+                    res["student_id"] = ids[idx] if idx < len(ids) else None
+                    line = {"index": idx, "filename": upload.filename}
+                    queued.append((line, _queue_result(res, upload, version, template_rev, exam_code)))
+                yield from _drain(queued)
+        # results are written behind; their lines go out once their batch commits
+        yield from _drain(queued, wait=True)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/evaluate/stack")
+async def evaluate_stack(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    version: str = Form(...),
+    student_ids: List[str] = Form(None),
+    exam_code: str = Form(None),
+):
+    """
+    Grades a scanned PDF stack where each page is a different student's sheet.
+    Streams NDJSON in page order: one object per page with its `page` number
+    and either the graded result or an `error` for that page alone. An
+    unknown version or a file that isn't a readable PDF is rejected with 400
+    before anything is streamed.
+    """
+    # stack pages are never deduplicated, so the PDF isn't hashed
+    upload = await _read_upload(file)
+    try:
+        pages = await run_in_threadpool(_open_stack, upload, version, student_ids, exam_code)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
+    background_tasks.add_task(_archive_upload, upload)
+
+    def stream():
+        # pages are written behind but still streamed in page order
+        queued = deque()
+        with contextlib.closing(pages):
+            for res in pages:
+                page = res["page"]
+                if "error" in res:
+                    queued.append(({"page": page, "error": res["error"]}, None))
+                else:
+                    # pages share the archived PDF; there is no per-page overlay
+                    page_upload = upload._replace(uid=f"{upload.uid}-p{page}",
+                                                  filename=f"{upload.filename}#page={page}",
+                                                  overlay_path=None)
+                    queued.append(({"page": page}, _queue_result(res, page_upload, version, exam_code=exam_code)))
+                yield from _drain(queued)
+        yield from _drain(queued, wait=True)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+def _open_stack(upload: Upload, version, student_ids, exam_code):
+    """
+    Page iterator of process_stack for an uploaded stack, scored with the
+    exam's key. Raises ValueError for an unknown version or a file that isn't
+    a readable PDF. Blocking (runs pdfinfo); call it off the event loop.
+    """
+    answer_key = _exam_answer_key(exam_code, version)
+    if answer_key is None:
+        # an unknown version would otherwise fail every page
+        processor.answer_keys.get(version)
+    return processor.process_stack(upload.data, version=version, student_ids=student_ids, answer_key=answer_key)
+
+def _exam_id_filter(db, exam_code):
+    """Exam.id for an optional exam_code query filter; 404 for unknown exams."""
+    if not exam_code:
+        return None
+    exam = crud.get_exam_by_code(db, exam_code)
+    if exam is None:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    return exam.id
+
+@app.get("/results")
+def list_results(limit: int = 50, cursor: str = None, exam_code: str = None, version: str = None):
+    """
+    Results newest first, `limit` per page (max 500). Pass the returned
+    next_cursor back as `cursor` for the following page; it is null on the last.
+    """
+    limit = max(1, min(limit, 500))
+    db = database.ReadSessionLocal()
+    try:
+        exam_id = _exam_id_filter(db, exam_code)
+        try:
+            rows, next_cursor = crud.list_results_page(db, limit, cursor, exam_id, version)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        db.close()
+    items = [{
+        "result_id": row.id,
+        "student_id": row.student_id,
+        "exam_code": row.exam_code,
+        "version": row.version,
+        "total_score": row.total_score,
+        "section_scores": crud.row_section_scores(row),
+        "reviewed": bool(row.reviewed),
+        "created_at": row.created_at,
+    } for row in rows]
+    return {"items": items, "next_cursor": next_cursor}
+
+@app.get("/results/export")
+def export_results(fmt: str = "csv", exam_code: str = None, version: str = None):
+    """
+    Download results as CSV (streamed as rows are read) or XLSX, optionally
+    for one exam / version. Memory use does not grow with the number of rows.
+    """
+    fmt = fmt.lower()
+    if fmt not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format '{fmt}' (use csv or xlsx)")
+    db = database.ReadSessionLocal()
+    try:
+        exam_id = _exam_id_filter(db, exam_code)
+    finally:
+        db.close()
+
+    rows = export.iter_export_rows(database.ReadSessionLocal, exam_id, version)
+    body = export.stream_csv(rows) if fmt == "csv" else export.stream_xlsx(rows)
+    media_type, ext = export.FORMATS[fmt]
+    filename = f"results_{exam_code or 'all'}{ext}"
+    return StreamingResponse(body, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+def _answer_key(db, exam_id, version):
+    """
+    CompiledKey an exam version is scored with: the key stored for the exam
+    (set by a rescore), else the processor's key for the version. Raises
+    ValueError for unknown versions.
+    """
+    stored = _stored_answer_key(db, exam_id, version)
+    if stored is not None:
+        return stored
+    return processor.answer_keys.get(version)
+
+def _stored_answer_key(db, exam_id, version):
+    """CompiledKey stored for an exam version by a rescore, or None."""
+    stored = crud.get_answer_key(db, exam_id, version)
+    return compile_key(version, stored.key) if stored is not None else None
+
+@app.get("/exams/{exam_code}/item-analysis")
+def item_analysis(exam_code: str, version: str = None):
+    """
+    Per-question option distribution and difficulty (share of sheets that
+    chose a keyed option) for an exam, from the maintained item_stats
+    counts: the cost depends on the number of questions, not of sheets.
+    `sheets` is the number of graded sheets of the version and is the
+    denominator of every difficulty; `responses` counts the sheets on which
+    the question was read at all (marked or blank).
+    """
+    db = database.ReadSessionLocal()
+    try:
+        exam_id = _exam_id_filter(db, exam_code)
+        stats = crud.get_item_stats(db, exam_id, version)
+        sheets = crud.count_sheets(db, exam_id, version)
+
+        # version -> question -> {option: count}
+        counts = {}
+        for stat in stats:
+            counts.setdefault(stat.version, {}).setdefault(stat.question, {})[stat.option] = stat.count
+
+        keys = {}
+        for ver in counts:
+            try:
+                keys[ver] = _answer_key(db, exam_id, ver).masks
+            except ValueError:
+                keys[ver] = None
+    finally:
+        db.close()
+
+    versions = {}
+    for ver, questions in counts.items():
+        key_masks = keys[ver]
+        items = []
+        for question in sorted(questions):
+            options = dict(questions[question])
+            blank = options.pop("", 0)
+            responses = blank + sum(options.values())
+            item = {"question": question, "responses": responses, "blank": blank, "options": options}
+            if key_masks is not None and question <= len(key_masks):
+                mask = int(key_masks[question - 1])
+                keyed = [letter for i, letter in enumerate(OPTION_LETTERS) if mask & (1 << i)]
+                correct = sum(n for option, n in options.items() if option in keyed)
+                item["key"] = ",".join(keyed)
+                item["difficulty"] = round(correct / sheets[ver], 4) if sheets.get(ver) else None
+            items.append(item)
+        versions[ver] = {"sheets": sheets.get(ver, 0), "questions": items}
+    return {"exam_code": exam_code, "versions": versions}
+
+@app.post("/exams/{exam_code}/rescore")
+def rescore_exam(exam_code: str, request: schemas.Rescore):
+    """
+    Apply a corrected answer key to every stored result of an exam version
+    from the stored answers (no images are read). The corrected key is
+    stored as the exam's key first: sheets of the exam graded from then on
+    are scored with it (see _exam_answer_key), and item analysis and later
+    rescores use it too. Each result records the key it was scored with, so
+    it doesn't matter whether the processor's key file is corrected before
+    or after this call; results scored with a key that is no longer known
+    are scored in full.
+    """
+    try:
+        new_key = compile_key(request.version, request.key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     db = database.SessionLocal()
-    created = crud.create_result(db, {
-        "student_id": result.get("student_id") or uid,
-        "sheet_path": out_path,
-        "version": version,
-        "total_score": result["total_score"],
-        "section_scores": result["section_scores"],
-        "raw_answers": result["answers"],
-    })
-    db.close()
+    try:
+        exam_id = _exam_id_filter(db, exam_code)
+        # keys results of this version may have been scored with
+        known_keys = [_stored_answer_key(db, exam_id, request.version)]
+        try:
+            known_keys.append(processor.answer_keys.get(request.version))
+        except ValueError:
+            pass
+        crud.set_answer_key(db, exam_id, request.version, request.key)
+        # results still queued for writing must be rescored too
+        writer.flush()
+        try:
+            summary = rescore.rescore_results(db, exam_id, request.version, new_key, known_keys, actor=request.actor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        db.close()
+    # cached duplicate-upload responses carry the old scores
+    results_cache.clear()
+    return {"exam_code": exam_code, "version": request.version, **summary}
 
-    # Return also overlay image path so client (UI) can fetch or display; you may want to serve static files
-    return JSONResponse(status_code=200, content={
-        "student_id": result.get("student_id") or uid,
-        "version": version,
-        "total_score": result["total_score"],
-        "section_scores": result["section_scores"],
-        "answers": result["answers"],
-        "overlay_path": result["overlay_path"],
-    })
+@app.get("/exams/{exam_code}/ranking")
+def exam_ranking(exam_code: str, metric: str = "total", score: int = None):
+    """
+    Score histogram of an exam for `metric` ("total" or a section such as
+    "subject_1"), with the percentile rank of every score, read from the
+    maintained score_bins. Pass `score` to also get that score's percentile.
+    """
+    db = database.ReadSessionLocal()
+    try:
+        exam_id = _exam_id_filter(db, exam_code)
+        bins = crud.get_score_bins(db, exam_id, metric).get(metric, [])
+    finally:
+        db.close()
+    histogram = [{"score": s, "count": n, "percentile": crud.percentile_rank(bins, s)} for s, n in bins]
+    payload = {"exam_code": exam_code, "metric": metric, "sheets": sum(n for _, n in bins), "histogram": histogram}
+    if score is not None:
+        payload["score"] = score
+        payload["percentile"] = crud.percentile_rank(bins, score)
+    return payload
 
 @app.get("/result/{student_id}")
 def get_result(student_id: str):
-    db = database.SessionLocal()
-    res = crud.get_result_by_student(db, student_id)
-    db.close()
-    if not res:
-        raise HTTPException(status_code=404, detail="Result not found")
-    return res
+    """
+    Latest result for a student. Results that belong to an exam also carry
+    their percentile rank for the total and for each section.
+    """
+    db = database.ReadSessionLocal()
+    try:
+        res = crud.get_result_by_student(db, student_id)
+        if not res:
+            raise HTTPException(status_code=404, detail="Result not found")
+        # section_scores / raw_answers columns resolve to the decoding properties
+        payload = {column.name: getattr(res, column.name) for column in res.__table__.columns
+                   if column.name not in PACKED_COLUMNS}
+        if res.exam_id is not None:
+            bins = crud.get_score_bins(db, res.exam_id)
+            if res.total_score is not None:
+                payload["percentile"] = crud.percentile_rank(bins.get("total", []), res.total_score)
+            payload["section_percentiles"] = {
+                name: crud.percentile_rank(bins.get(name, []), value)
+                for name, value in (res.section_scores or {}).items() if value is not None
+            }
+    finally:
+        db.close()
+    return payload
 
 @app.get("/overlay/{filename}")
-def get_overlay_image(filename: str):
+def get_overlay_image(filename: str, fmt: str = None, quality: int = None, max_dim: int = None):
     """
-    If you want to serve overlay images via API (for frontend to fetch),
-    you can map URL -> file in uploads folder.
+    Serves the overlay named in a result's overlay_path (<uid>_overlay.png).
+    Overlays are rendered from the archived upload on first request and cached
+    in the uploads folder. fmt (png/jpg/webp), quality and max_dim (thumbnail
+    size) override the OMR_OVERLAY_* defaults.
     """
+    filename = os.path.basename(filename)
     file_path = os.path.join(UPLOAD_DIR, filename)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="Overlay not found")
-    return FileResponse(file_path, media_type="image/png")
+    if fmt is None and quality is None and max_dim is None and os.path.exists(file_path):
+        ext = os.path.splitext(filename)[1].lower()
+        return FileResponse(file_path, media_type=MEDIA_TYPES.get(ext, "image/png"))
+
+    fmt = (fmt or OVERLAY_FORMAT).lower()
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported overlay format '{fmt}'")
+    quality = quality or OVERLAY_QUALITY
+    max_dim = OVERLAY_MAX_DIM if max_dim is None else max_dim
+    ext = FORMATS[fmt][0]
+
+    stem = filename.split("_overlay")[0]
+    variant = (f"_{max_dim}px" if max_dim else "") + (f"_q{quality}" if ext != ".png" else "")
+    cached_path = os.path.join(UPLOAD_DIR, f"{stem}_overlay{variant}{ext}")
+    if not os.path.exists(cached_path):
+        spec_path = os.path.join(UPLOAD_DIR, f"{stem}_overlay.json")
+        if not os.path.exists(spec_path):
+            raise HTTPException(status_code=404, detail="Overlay not found")
+        with open(spec_path) as f:
+            spec = json.load(f)
+        img = load_image(spec["source"]) if spec.get("source") else None
+        if img is None:
+            raise HTTPException(status_code=404, detail="Original upload for overlay not found")
+        data, _ = render_overlay(img, spec, fmt=fmt, quality=quality, max_dim=max_dim)
+        # write then rename so concurrent requests never serve a partial file
+        tmp_path = f"{cached_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, cached_path)
+    return FileResponse(cached_path, media_type=MEDIA_TYPES[ext])
 
 @app.get("/health")
 def health():
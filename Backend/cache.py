@@ -0,0 +1,57 @@
+# backend/cache.py
+
+"""
+Bounded in-process LRU for graded results.
+
+Keys are (content hash, version, processor revision) tuples; values are
+whatever the caller stores (app.py keeps the result id and response payload).
+It sits in front of the persistent hash index on `results.content_hash`, so a
+repeat upload is answered from memory when it is recent and from one indexed
+query otherwise.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, max_entries=None):
+        if max_entries is None:
+            max_entries = int(os.environ.get("OMR_RESULT_CACHE_SIZE", "1024"))
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
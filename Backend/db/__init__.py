@@ -1,6 +1,6 @@
-from .database import Base, engine, SessionLocal
+from .database import Base, engine, SessionLocal, read_engine, ReadSessionLocal
 from . import models
 from . import crud
 from . import schemas
 
-__all__ = ['Base', 'engine', 'SessionLocal', 'models', 'crud', 'schemas']
\ No newline at end of file
+__all__ = ['Base', 'engine', 'SessionLocal', 'read_engine', 'ReadSessionLocal', 'models', 'crud', 'schemas']
\ No newline at end of file
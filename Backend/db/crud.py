@@ -1,6 +1,12 @@
 # backend/db/crud.py
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, false, func, or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from . import models, schemas
+from .packing import SECTION_COLUMNS, pack_answers, pack_sections, unpack_answers, unpack_sections
 from typing import Optional, List, Dict
 
 # -------- Student --------
@@ -32,6 +38,17 @@ def create_exam(db: Session, exam: Dict):
 def get_exam_by_code(db: Session, code: str):
     return db.query(models.Exam).filter(models.Exam.exam_code == code).first()
 
+def get_or_create_exam(db: Session, code: str):
+    exam = get_exam_by_code(db, code)
+    if exam:
+        return exam
+    try:
+        return create_exam(db, {"exam_code": code})
+    except IntegrityError:
+        # another request created it between the select and the insert
+        db.rollback()
+        return get_exam_by_code(db, code)
+
 def create_answer_key(db: Session, exam_id: int, version: str, key: Dict):
     ak = models.AnswerKey(exam_id=exam_id, version=version, key=key)
     db.add(ak)
@@ -42,7 +59,61 @@ def create_answer_key(db: Session, exam_id: int, version: str, key: Dict):
 def get_answer_key(db: Session, exam_id: int, version: str):
     return db.query(models.AnswerKey).filter(models.AnswerKey.exam_id == exam_id, models.AnswerKey.version == version).first()
 
+def set_answer_key(db: Session, exam_id: int, version: str, key):
+    """Store the key of an exam version, replacing the current one."""
+    ak = get_answer_key(db, exam_id, version)
+    if ak is None:
+        return create_answer_key(db, exam_id, version, key)
+    ak.key = key
+    db.commit()
+    db.refresh(ak)
+    return ak
+
 # -------- Results --------
+def get_or_create_students(db: Session, identifiers, names: Optional[Dict[str, str]] = None):
+    """
+    Map student identifiers to Student.id, inserting the missing ones in one
+    bulk insert. Flushes but does not commit (the caller owns the transaction).
+    """
+    wanted = {i for i in identifiers if i}
+    if not wanted:
+        return {}
+    ids = dict(db.query(models.Student.student_id, models.Student.id)
+               .filter(models.Student.student_id.in_(wanted)).all())
+    missing = wanted - set(ids)
+    if missing:
+        names = names or {}
+        db.bulk_insert_mappings(models.Student, [{"student_id": i, "name": names.get(i)} for i in sorted(missing)])
+        ids.update(db.query(models.Student.student_id, models.Student.id)
+                   .filter(models.Student.student_id.in_(missing)).all())
+    return ids
+
+def _result_row(payload: Dict, student_ref: Optional[int]):
+    # mapping keys are Result attribute names; answers and sections are stored packed
+    return dict(
+        student_id=student_ref,
+        uploaded_filename=payload.get("uploaded_filename") or payload.get("uploaded_path", "").split("/")[-1],
+        uploaded_path=payload.get("uploaded_path"),
+        exam_id=payload.get("exam_id"),
+        version=payload.get("version"),
+        total_score=payload.get("total_score"),
+        answers_packed=pack_answers(payload.get("raw_answers")),
+        **pack_sections(payload.get("section_scores")),
+        overlay_path=payload.get("overlay_path"),
+        content_hash=payload.get("content_hash"),
+        template_rev=payload.get("template_rev"),
+        phash=payload.get("phash"),
+        key_fingerprint=payload.get("key_fingerprint"),
+    )
+
+def _audit_rows(result_id: int, payload: Dict):
+    # the "evaluated" entry plus any extra (action, note) pairs in payload["audit"]
+    actor = payload.get("actor", "system")
+    rows = [dict(result_id=result_id, action="evaluated", actor=actor, note="Auto-evaluated by OMRProcessor")]
+    for action, note in payload.get("audit") or ():
+        rows.append(dict(result_id=result_id, action=action, actor=actor, note=note))
+    return rows
+
 def create_result(db: Session, payload: Dict):
     """
     payload keys expected (some optional):
@@ -55,46 +126,303 @@ def create_result(db: Session, payload: Dict):
     - section_scores
     - raw_answers
     - overlay_path
+    - content_hash, template_rev (duplicate-upload lookup, see get_result_by_hash)
+    - phash (perceptual sheet hash, see list_exam_phashes)
+    - key_fingerprint (CompiledKey.fingerprint of the key it was scored with)
+    - audit: extra (action, note) audit entries besides "evaluated"
+    The student, result and audit entries are written in one transaction.
     """
     # accept student identifier string to create student
     student_ref = None
     if payload.get("student_identifier"):
-        student = get_or_create_student(db, payload["student_identifier"], payload.get("student_name"))
-        student_ref = student.id
+        identifier = payload["student_identifier"]
+        student_ref = get_or_create_students(db, [identifier], {identifier: payload.get("student_name")})[identifier]
     elif payload.get("student_id"):
         student_ref = payload.get("student_id")
 
-    res = models.Result(
-        student_id=student_ref,
-        uploaded_filename=payload.get("uploaded_filename") or payload.get("uploaded_path", "").split("/")[-1],
-        uploaded_path=payload.get("uploaded_path"),
-        exam_id=payload.get("exam_id"),
-        version=payload.get("version"),
-        total_score=payload.get("total_score"),
-        section_scores=payload.get("section_scores"),
-        raw_answers=payload.get("raw_answers"),
-        overlay_path=payload.get("overlay_path"),
-    )
+    res = models.Result(**_result_row(payload, student_ref))
     db.add(res)
+    db.flush()
+    db.add_all([models.AuditLog(**row) for row in _audit_rows(res.id, payload)])
+    bump_item_stats(db, [payload])
+    bump_score_bins(db, [payload])
     db.commit()
     db.refresh(res)
-
-    # create audit log
-    create_audit_log(db, res.id, action="evaluated", actor=payload.get("actor", "system"), note="Auto-evaluated by OMRProcessor")
     return res
 
-def get_result_by_student(db: Session, student_identifier: str):
-    # try to find student then return most recent result
-    student = db.query(models.Student).filter(models.Student.student_id == student_identifier).first()
-    if not student:
+def bulk_create_results(db: Session, payloads: List[Dict], audit_logs: List[Dict] = ()):
+    """
+    Insert many results (same payload format as create_result) in a single
+    transaction: one student lookup / bulk insert, the result rows, then all
+    audit entries in one executemany. audit_logs are extra standalone entries
+    (result_id, action, actor, note) written in the same transaction.
+    Returns the new result ids in payload order.
+    """
+    identifiers = [p.get("student_identifier") for p in payloads]
+    names = {p["student_identifier"]: p.get("student_name") for p in payloads if p.get("student_identifier")}
+    student_ids = get_or_create_students(db, identifiers, names)
+
+    rows = []
+    for payload in payloads:
+        ref = student_ids.get(payload.get("student_identifier")) or payload.get("student_id")
+        rows.append(_result_row(payload, ref))
+    # return_defaults fills in each row's primary key
+    db.bulk_insert_mappings(models.Result, rows, return_defaults=True)
+    result_ids = [row["id"] for row in rows]
+
+    audit_rows = list(audit_logs)
+    for result_id, payload in zip(result_ids, payloads):
+        audit_rows.extend(_audit_rows(result_id, payload))
+    if audit_rows:
+        db.bulk_insert_mappings(models.AuditLog, audit_rows)
+    bump_item_stats(db, payloads)
+    bump_score_bins(db, payloads)
+    db.commit()
+    return result_ids
+
+# -------- Aggregates --------
+def increment_counts(db: Session, model, rows: List[Dict]):
+    """
+    Add each row's "count" to the model row with the same primary key,
+    inserting rows that don't exist yet. One upsert statement on SQLite and
+    PostgreSQL; update-then-insert per row elsewhere. Doesn't commit.
+    """
+    if not rows:
+        return
+    table = model.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[c.name for c in table.primary_key.columns],
+            set_={"count": table.c.count + stmt.excluded.count},
+        )
+        db.execute(stmt, rows)
+        return
+    for row in rows:
+        key = {c.name: row[c.name] for c in table.primary_key.columns}
+        updated = db.query(model).filter_by(**key).update({"count": model.count + row["count"]},
+                                                          synchronize_session=False)
+        if not updated:
+            db.add(model(**row))
+
+def section_columns():
+    """Columns to select for row_section_scores: the packed sections and the legacy JSON."""
+    return [getattr(models.Result, name) for name in SECTION_COLUMNS] + [models.Result.legacy_section_scores]
+
+def row_section_scores(row):
+    """{"subject_1": n, ...} of a row selected with section_columns()."""
+    sections = unpack_sections(getattr(row, name) for name in SECTION_COLUMNS)
+    return sections if sections is not None else row.legacy_section_scores
+
+def bump_item_stats(db: Session, payloads: List[Dict]):
+    """Count the answers of results that belong to an exam into item_stats."""
+    counts = {}
+    for payload in payloads:
+        exam_id = payload.get("exam_id")
+        if exam_id is None:
+            continue
+        version = payload.get("version") or ""
+        for question, option in (payload.get("raw_answers") or {}).items():
+            key = (exam_id, version, int(question), option or "")
+            counts[key] = counts.get(key, 0) + 1
+    increment_counts(db, models.ItemStat, [
+        {"exam_id": e, "version": v, "question": q, "option": o, "count": n}
+        for (e, v, q, o), n in counts.items()
+    ])
+
+def rebuild_item_stats(db: Session, chunk: int = 1000):
+    """Recount item_stats from every stored result (one pass, for backfills)."""
+    db.query(models.ItemStat).delete(synchronize_session=False)
+    R = models.Result
+    query = db.query(R.exam_id, R.version, R.answers_packed, R.legacy_raw_answers) \
+        .filter(R.exam_id.isnot(None)).yield_per(chunk)
+    batch = []
+    for exam_id, version, packed, legacy in query:
+        raw_answers = unpack_answers(packed) if packed is not None else legacy
+        batch.append({"exam_id": exam_id, "version": version, "raw_answers": raw_answers})
+        if len(batch) >= chunk:
+            bump_item_stats(db, batch)
+            batch = []
+    bump_item_stats(db, batch)
+    db.commit()
+
+def _score_metrics(total_score, section_scores):
+    # (metric, score) pairs a result contributes to its exam's histograms
+    if total_score is not None:
+        yield "total", int(total_score)
+    for name, value in (section_scores or {}).items():
+        if value is not None:
+            yield name, int(value)
+
+def score_bin_rows(deltas):
+    """{(exam_id, metric, score): count delta} -> rows for increment_counts (zero deltas dropped)."""
+    return [{"exam_id": e, "metric": m, "score": s, "count": n}
+            for (e, m, s), n in deltas.items() if n]
+
+def bump_score_bins(db: Session, payloads: List[Dict], sign: int = 1):
+    """Add (sign=1) or remove (sign=-1) results' scores from their exam's histograms."""
+    deltas = {}
+    for payload in payloads:
+        exam_id = payload.get("exam_id")
+        if exam_id is None:
+            continue
+        for metric, score in _score_metrics(payload.get("total_score"), payload.get("section_scores")):
+            key = (exam_id, metric, score)
+            deltas[key] = deltas.get(key, 0) + sign
+    increment_counts(db, models.ScoreBin, score_bin_rows(deltas))
+
+def rebuild_score_bins(db: Session, chunk: int = 1000):
+    """Recount score_bins from every stored result (one pass, for backfills)."""
+    db.query(models.ScoreBin).delete(synchronize_session=False)
+    R = models.Result
+    query = db.query(R.exam_id, R.total_score, *section_columns()) \
+        .filter(R.exam_id.isnot(None)).yield_per(chunk)
+    batch = []
+    for row in query:
+        batch.append({"exam_id": row.exam_id, "total_score": row.total_score, "section_scores": row_section_scores(row)})
+        if len(batch) >= chunk:
+            bump_score_bins(db, batch)
+            batch = []
+    bump_score_bins(db, batch)
+    db.commit()
+
+def get_score_bins(db: Session, exam_id: int, metric: Optional[str] = None):
+    """{metric: [(score, count), ...] ascending} for an exam (at most one row per possible score)."""
+    q = db.query(models.ScoreBin.metric, models.ScoreBin.score, models.ScoreBin.count).filter(
+        models.ScoreBin.exam_id == exam_id, models.ScoreBin.count > 0)
+    if metric is not None:
+        q = q.filter(models.ScoreBin.metric == metric)
+    bins = {}
+    for m, score, count in q.order_by(models.ScoreBin.metric, models.ScoreBin.score):
+        bins.setdefault(m, []).append((score, count))
+    return bins
+
+def percentile_rank(bins, score):
+    """
+    Percentile (0-100) of a score within a histogram: share of sheets below
+    it plus half of those tied with it. None for an empty histogram.
+    """
+    total = below = equal = 0
+    for s, count in bins:
+        total += count
+        if s < score:
+            below += count
+        elif s == score:
+            equal += count
+    if not total:
         return None
-    return db.query(models.Result).filter(models.Result.student_id == student.id).order_by(models.Result.created_at.desc()).first()
+    return round(100.0 * (below + 0.5 * equal) / total, 2)
+
+def get_item_stats(db: Session, exam_id: int, version: Optional[str] = None):
+    q = db.query(models.ItemStat).filter(models.ItemStat.exam_id == exam_id)
+    if version is not None:
+        q = q.filter(models.ItemStat.version == version)
+    return q.order_by(models.ItemStat.version, models.ItemStat.question, models.ItemStat.option).all()
+
+def count_sheets(db: Session, exam_id: int, version: Optional[str] = None):
+    """{version: number of results} for an exam (served by ix_results_exam_version)."""
+    q = db.query(models.Result.version, func.count()).filter(models.Result.exam_id == exam_id)
+    if version is not None:
+        q = q.filter(models.Result.version == version)
+    return dict(q.group_by(models.Result.version).all())
+
+# The query_* builders below return unexecuted queries for the hot lookups, so
+# db/plans.py can check their plans against the same SQL the app runs.
+
+def query_result_by_student(db: Session, student_identifier: str):
+    # most recent result for a student identifier, in one join
+    # (served by ix_students_student_id and ix_results_student_created)
+    return db.query(models.Result).join(models.Student, models.Result.student_id == models.Student.id).filter(
+        models.Student.student_id == student_identifier,
+    ).order_by(models.Result.created_at.desc(), models.Result.id.desc()).limit(1)
+
+def get_result_by_student(db: Session, student_identifier: str):
+    return query_result_by_student(db, student_identifier).first()
+
+def query_result_by_hash(db: Session, content_hash: str, version: str, template_rev: str):
+    # earliest result graded from these exact bytes under the same version / processor revision
+    return db.query(models.Result).filter(
+        models.Result.content_hash == content_hash,
+        models.Result.version == version,
+        models.Result.template_rev == template_rev,
+    ).order_by(models.Result.id).limit(1)
+
+def get_result_by_hash(db: Session, content_hash: str, version: str, template_rev: str):
+    return query_result_by_hash(db, content_hash, version, template_rev).first()
+
+def query_exam_phashes(db: Session, exam_id: int, after_id: int = 0):
+    # (result id, phash hex) for an exam's fingerprinted results with id > after_id
+    return db.query(models.Result.id, models.Result.phash).filter(
+        models.Result.exam_id == exam_id,
+        models.Result.id > after_id,
+        models.Result.phash.isnot(None),
+    ).order_by(models.Result.id)
+
+def list_exam_phashes(db: Session, exam_id: int, after_id: int = 0):
+    return query_exam_phashes(db, exam_id, after_id).all()
+
+def query_unreviewed_results(db: Session, limit: int = 100):
+    # oldest results still waiting for review
+    return db.query(models.Result).filter(models.Result.reviewed == false()).order_by(
+        models.Result.created_at, models.Result.id).limit(limit)
+
+def list_unreviewed_results(db: Session, limit: int = 100):
+    return query_unreviewed_results(db, limit).all()
 
 def get_result_by_id(db: Session, result_id: int):
     return db.query(models.Result).filter(models.Result.id == result_id).first()
 
-def list_results(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Result).order_by(models.Result.created_at.desc()).offset(skip).limit(limit).all()
+# -------- Result listing / export (keyset pagination) --------
+def encode_cursor(created_at: datetime, result_id: int):
+    """Opaque cursor for the row a page ended on."""
+    raw = json.dumps([created_at.isoformat() if created_at else None, result_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    """(created_at, id) from encode_cursor; raises ValueError for malformed cursors."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, result_id = json.loads(raw)
+        return (datetime.fromisoformat(created_at) if created_at else None), int(result_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def query_result_rows(db: Session, exam_id: Optional[int] = None, version: Optional[str] = None,
+                      cursor: Optional[str] = None):
+    """
+    Flat result rows (id, student identifier, exam code, version, total,
+    the section score columns (see row_section_scores), reviewed,
+    created_at), newest first by (created_at, id). With a cursor, only the
+    rows after it; pages cost the same however deep they are.
+    """
+    R = models.Result
+    q = db.query(R.id, models.Student.student_id, models.Exam.exam_code, R.version, R.total_score,
+                 *section_columns(), R.reviewed, R.created_at) \
+        .outerjoin(models.Student, R.student_id == models.Student.id) \
+        .outerjoin(models.Exam, R.exam_id == models.Exam.id)
+    if exam_id is not None:
+        q = q.filter(R.exam_id == exam_id)
+    if version is not None:
+        q = q.filter(R.version == version)
+    if cursor:
+        created_at, result_id = decode_cursor(cursor)
+        q = q.filter(or_(R.created_at < created_at, and_(R.created_at == created_at, R.id < result_id)))
+    return q.order_by(R.created_at.desc(), R.id.desc())
+
+def list_results_page(db: Session, limit: int = 100, cursor: Optional[str] = None,
+                      exam_id: Optional[int] = None, version: Optional[str] = None):
+    """One page of query_result_rows; returns (rows, next_cursor or None)."""
+    rows = query_result_rows(db, exam_id, version, cursor).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
 
 def mark_result_reviewed(db: Session, result_id: int, reviewer: Optional[str] = None, note: Optional[str] = None):
     res = get_result_by_id(db, result_id)
@@ -1,24 +1,110 @@
 # backend/db/database.py
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
 
 # Read DB URL from env; default to sqlite file for local/dev
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./omr_results.db")
+# optional replica / read-only connection used by GET endpoints (default: DATABASE_URL)
+DATABASE_READ_URL = os.environ.get("DATABASE_READ_URL") or None
 
-# SQLite needs check_same_thread False; other DBs ignore the argument
-connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+# connection pool sizing (per engine, per process)
+POOL_SIZE = int(os.environ.get("OMR_DB_POOL_SIZE", "10"))
+MAX_OVERFLOW = int(os.environ.get("OMR_DB_MAX_OVERFLOW", "20"))
+POOL_TIMEOUT = float(os.environ.get("OMR_DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.environ.get("OMR_DB_POOL_RECYCLE", "1800"))
 
-engine = create_engine(DATABASE_URL, connect_args=connect_args, echo=False)
+# SQLite tuning: WAL lets readers run while a grader writes; NORMAL sync is
+# durable across app crashes in WAL mode and avoids an fsync per commit
+SQLITE_JOURNAL_MODE = os.environ.get("OMR_SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.environ.get("OMR_SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("OMR_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_KB = int(os.environ.get("OMR_SQLITE_CACHE_KB", "65536"))
+SQLITE_MMAP_BYTES = int(os.environ.get("OMR_SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+
+def _is_sqlite(url):
+    return url.startswith("sqlite")
+
+def _is_sqlite_memory(url):
+    return url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url
+
+def _apply_sqlite_pragmas(dbapi_conn, connection_record):
+    cursor = dbapi_conn.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_BYTES}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+def make_engine(url):
+    """
+    Engine with pool settings from the environment. SQLite files get a
+    QueuePool (so concurrent graders don't open a connection per session) and
+    the WAL pragmas above on every new connection; in-memory SQLite shares one
+    connection. Other databases get a pre-pinged, recycled QueuePool.
+    """
+    if not _is_sqlite(url):
+        return create_engine(url, echo=False, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                             pool_timeout=POOL_TIMEOUT, pool_recycle=POOL_RECYCLE, pool_pre_ping=True)
+
+    # SQLite needs check_same_thread False; busy waits are handled by the pragma
+    connect_args = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000.0}
+    if _is_sqlite_memory(url):
+        return create_engine(url, echo=False, connect_args=connect_args, poolclass=StaticPool)
+    sqlite_engine = create_engine(url, echo=False, connect_args=connect_args, poolclass=QueuePool,
+                                  pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT)
+    event.listen(sqlite_engine, "connect", _apply_sqlite_pragmas)
+    return sqlite_engine
+
+engine = make_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# reads that can tolerate replica lag (GET endpoints) go through ReadSessionLocal
+read_engine = make_engine(DATABASE_READ_URL) if DATABASE_READ_URL else engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
 Base = declarative_base()
 
+def _pool_stats(pool):
+    stats = {"pool": type(pool).__name__, "status": pool.status()}
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        checked_out = pool.checkedout()
+        stats.update({
+            "size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "checked_in": pool.checkedin(),
+            "checked_out": checked_out,
+            "overflow": pool.overflow(),
+            # fraction of the connections this engine may open that are in use
+            "saturation": round(checked_out / capacity, 3) if capacity > 0 else None,
+        })
+    return stats
+
+def get_pool_stats():
+    """Connection pool usage for the write engine and (if separate) the read engine."""
+    stats = {"write": _pool_stats(engine.pool)}
+    if read_engine is not engine:
+        stats["read"] = _pool_stats(read_engine.pool)
+    return stats
+
 def init_db():
+    """
+    Create missing tables, add the columns and indexes that existing tables
+    lack, and fill aggregate tables created on a database that already has
+    results (see migrate.py). Called at startup (see app.py) rather than on
+    import, so importing the models costs no database round trips.
+    """
     # Import models here so they are registered with Base.metadata
     from . import models  # noqa: F401
+    from sqlalchemy import inspect
+    from .migrate import upgrade_schema
+    existing = set(inspect(engine).get_table_names())
     Base.metadata.create_all(bind=engine)
-
-# Initialize DB tables on import (safe for dev; in production use migrations)
-init_db()
\ No newline at end of file
+    upgrade_schema(engine, new_tables=set(Base.metadata.tables) - existing if existing else set())
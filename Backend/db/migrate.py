@@ -0,0 +1,109 @@
+# backend/db/migrate.py
+"""
+Additive, in-place schema upgrades.
+
+create_all() only creates tables that don't exist yet, so databases created
+by an older version of the models miss newer columns and indexes. This adds
+them (ALTER TABLE ... ADD COLUMN, CREATE INDEX) and never drops or rewrites
+anything. New columns must be nullable or have a server default.
+
+Aggregate tables (item_stats, ...) that are created on an existing database
+are backfilled from the stored results once, right after creation.
+
+pack_results converts rows written before answers / section scores were
+stored packed (see packing.py). It works in short id-ordered transactions,
+so it can run while the app serves requests; until a row is converted its
+legacy JSON is read instead. SQLite only returns the freed pages to the OS
+after a VACUUM.
+"""
+import logging
+from sqlalchemy import and_, bindparam, inspect, or_, select
+from sqlalchemy.schema import CreateIndex
+from .database import Base
+from .packing import pack_answers, pack_sections
+
+logger = logging.getLogger(__name__)
+
+# new aggregate table -> crud function that fills it from the results table
+BACKFILLS = {
+    "item_stats": "rebuild_item_stats",
+    "score_bins": "rebuild_score_bins",
+}
+
+def upgrade_schema(engine, metadata=None, new_tables=()):
+    """
+    Add missing columns and indexes for every mapped table that already
+    exists, then backfill aggregate tables listed in new_tables (tables that
+    init_db just created on a database that already had data).
+    """
+    metadata = metadata or Base.metadata
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                ddl = f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {col_type}"
+                logger.info("Schema upgrade: %s", ddl)
+                conn.exec_driver_sql(ddl)
+
+            indexes = {ix["name"] for ix in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in indexes:
+                    continue
+                logger.info("Schema upgrade: creating index %s", index.name)
+                conn.execute(CreateIndex(index))
+
+    backfill = [name for name in BACKFILLS if name in new_tables]
+    if backfill:
+        from sqlalchemy.orm import Session
+        from . import crud
+        with Session(bind=engine) as db:
+            for name in backfill:
+                logger.info("Schema upgrade: backfilling %s", name)
+                getattr(crud, BACKFILLS[name])(db)
+
+def has_unpacked_results(engine):
+    """True while any result still keeps its answers or section scores as JSON."""
+    table = Base.metadata.tables["results"]
+    with engine.connect() as conn:
+        return conn.execute(select(table.c.id).where(_unpacked(table)).limit(1)).first() is not None
+
+def _unpacked(table):
+    return or_(table.c.raw_answers.isnot(None), table.c.section_scores.isnot(None))
+
+def pack_results(engine, chunk=1000):
+    """
+    Move legacy JSON answers / section scores into the packed columns, chunk
+    rows per transaction, and clear the JSON. A row that was rewritten in
+    the meantime (answers_packed already set) keeps its new values. Returns
+    the number of rows converted.
+    """
+    table = Base.metadata.tables["results"]
+    update = table.update().where(and_(table.c.id == bindparam("row_id"), table.c.answers_packed.is_(None))) \
+        .values(answers_packed=bindparam("packed"), raw_answers=None, section_scores=None,
+                **{name: bindparam(name) for name in pack_sections(None)})
+    converted, last_id = 0, 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.raw_answers, table.c.section_scores)
+                .where(and_(table.c.id > last_id, _unpacked(table)))
+                .order_by(table.c.id).limit(chunk)).fetchall()
+            if not rows:
+                break
+            conn.execute(update, [
+                dict(row_id=row.id, packed=pack_answers(row.raw_answers), **pack_sections(row.section_scores))
+                for row in rows
+            ])
+        converted += len(rows)
+        last_id = rows[-1].id
+        logger.info("Packed %d legacy results (up to id %d)", converted, last_id)
+    return converted
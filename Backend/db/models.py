@@ -1,7 +1,16 @@
 # backend/db/models.py
-from sqlalchemy import Column, Integer, String, JSON, DateTime, Boolean, ForeignKey, Text, func
+from sqlalchemy import (Column, Integer, SmallInteger, String, JSON, LargeBinary, DateTime, Boolean,
+                        ForeignKey, Text, Index, func)
 from sqlalchemy.orm import relationship
+from sqlalchemy.dialects import sqlite
 from .database import Base
+from .packing import SECTION_COLUMNS, pack_answers, unpack_answers, pack_sections, unpack_sections
+
+# SQLite's CURRENT_TIMESTAMP is stored as "YYYY-MM-DD HH:MM:SS"; bind datetimes
+# in the same format so keyset comparisons on created_at match stored values
+Timestamp = DateTime(timezone=True).with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite")
 
 class Student(Base):
     __tablename__ = "students"  # Fixed: double underscores
@@ -38,14 +47,92 @@ class Result(Base):
     exam_id = Column(Integer, ForeignKey("exams.id"), nullable=True)
     version = Column(String, nullable=True)
     total_score = Column(Integer, nullable=True)
-    section_scores = Column(JSON, nullable=True)
-    raw_answers = Column(JSON, nullable=True)
+    # one option bitmask byte per question (see packing.py) and one small
+    # integer column per section; read and written through the raw_answers /
+    # section_scores properties below
+    answers_packed = Column(LargeBinary, nullable=True)
+    subject_1 = Column(SmallInteger, nullable=True)
+    subject_2 = Column(SmallInteger, nullable=True)
+    subject_3 = Column(SmallInteger, nullable=True)
+    subject_4 = Column(SmallInteger, nullable=True)
+    subject_5 = Column(SmallInteger, nullable=True)
+    # JSON columns written by older versions; only read until
+    # migrate.pack_results has converted the row, then cleared
+    legacy_section_scores = Column("section_scores", JSON(none_as_null=True), nullable=True)
+    legacy_raw_answers = Column("raw_answers", JSON(none_as_null=True), nullable=True)
     overlay_path = Column(String, nullable=True)
     reviewed = Column(Boolean, default=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # sha256 of the uploaded bytes + processor revision (see OMRProcessor.revision),
+    # used to answer re-uploads of the same sheet without grading it again
+    content_hash = Column(String(64), nullable=True)
+    template_rev = Column(String(32), nullable=True)
+    # perceptual hash of the warped sheet (hex, see omr/phash.py) for rescan detection
+    phash = Column(String(64), nullable=True)
+    # CompiledKey.fingerprint of the answer key the scores were computed with
+    key_fingerprint = Column(String(16), nullable=True)
+    created_at = Column(Timestamp, server_default=func.now())
     student = relationship("Student", back_populates="sheets")
     exam = relationship("Exam")
 
+    __table_args__ = (
+        Index("ix_results_content_hash", "content_hash", "version", "template_rev"),
+        # latest result per student (crud.get_result_by_student)
+        Index("ix_results_student_created", "student_id", "created_at", "id"),
+        # per-exam scans: rescan index loads, item analysis, exports
+        Index("ix_results_exam_version", "exam_id", "version"),
+        # review queue, oldest first
+        Index("ix_results_reviewed", "reviewed", "created_at"),
+        # newest-first listing / keyset pagination (crud.query_result_rows)
+        Index("ix_results_created", "created_at", "id"),
+        Index("ix_results_exam_created", "exam_id", "created_at", "id"),
+    )
+
+    @property
+    def raw_answers(self):
+        if self.answers_packed is not None:
+            return unpack_answers(self.answers_packed)
+        return self.legacy_raw_answers
+
+    @raw_answers.setter
+    def raw_answers(self, answers):
+        self.answers_packed = pack_answers(answers)
+        self.legacy_raw_answers = None
+
+    @property
+    def section_scores(self):
+        sections = unpack_sections(getattr(self, name) for name in SECTION_COLUMNS)
+        return sections if sections is not None else self.legacy_section_scores
+
+    @section_scores.setter
+    def section_scores(self, section_scores):
+        for name, value in pack_sections(section_scores).items():
+            setattr(self, name, value)
+        self.legacy_section_scores = None
+
+class ItemStat(Base):
+    """
+    How many sheets of an exam version chose each option of each question,
+    kept up to date by crud as results are written (see crud.bump_item_stats).
+    """
+    __tablename__ = "item_stats"
+    exam_id = Column(Integer, ForeignKey("exams.id", ondelete="CASCADE"), primary_key=True)
+    version = Column(String, primary_key=True)
+    question = Column(Integer, primary_key=True)
+    option = Column(String(8), primary_key=True)  # "" = left blank
+    count = Column(Integer, nullable=False, default=0)
+
+class ScoreBin(Base):
+    """
+    Score histogram per exam: how many sheets scored `score` on `metric`
+    ("total" or a section name such as "subject_1"). Maintained by crud on
+    insert and rescore; percentiles are read from it (crud.percentile_rank).
+    """
+    __tablename__ = "score_bins"
+    exam_id = Column(Integer, ForeignKey("exams.id", ondelete="CASCADE"), primary_key=True)
+    metric = Column(String(32), primary_key=True)
+    score = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
 class AuditLog(Base):
     __tablename__ = "audit_logs"  # Fixed: double underscores
     id = Column(Integer, primary_key=True, index=True)
@@ -53,4 +140,9 @@ class AuditLog(Base):
     action = Column(String, nullable=False)
     actor = Column(String, nullable=True)
     note = Column(Text, nullable=True)
-    timestamp = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    timestamp = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # crud.get_audit_logs_for_result
+        Index("ix_audit_logs_result", "result_id", "timestamp"),
+    )
\ No newline at end of file
@@ -0,0 +1,71 @@
+# backend/db/packing.py
+"""
+Fixed-width storage encoding for graded answers.
+
+A sheet's answers are stored as one byte per question (question 1 first),
+using the same option bitmask as omr.scoring: bit i set = option i marked,
+0 = left blank. 100 questions take 100 bytes instead of a ~1.2 KB JSON
+dict, and a whole column of them loads straight into a (sheets x questions)
+uint8 matrix for vectorized work (see unpack_matrix).
+
+Section scores live in the subject_1..subject_N SmallInteger columns of
+results (see SECTION_COLUMNS).
+"""
+import numpy as np
+
+from ..omr.scoring import OPTION_LETTERS, NUM_SECTIONS, option_mask
+
+SECTION_COLUMNS = [f"subject_{i}" for i in range(1, NUM_SECTIONS + 1)]
+# results columns that hold the packed form (the API shows the decoded dicts instead)
+PACKED_COLUMNS = ["answers_packed"] + SECTION_COLUMNS
+
+# mask -> answer string ("A", "A,C"), None for blank
+_DECODE = [None] + [",".join(OPTION_LETTERS[i] for i in range(len(OPTION_LETTERS)) if mask >> i & 1)
+                    for mask in range(1, 256)]
+
+
+def pack_answers(answers):
+    """{question: option(s)} (question numbers from 1, int or str keys) -> bytes, or None."""
+    if answers is None:
+        return None
+    entries = {}
+    for question, value in answers.items():
+        if str(question).isdigit() and int(question) >= 1:
+            entries[int(question)] = option_mask(value)
+    if not entries:
+        return b""
+    packed = bytearray(max(entries))
+    for question, mask in entries.items():
+        packed[question - 1] = mask
+    return bytes(packed)
+
+
+def unpack_answers(packed):
+    """bytes from pack_answers -> {"1": "A", "2": None, ...}, or None."""
+    if packed is None:
+        return None
+    return {str(q): _DECODE[mask] for q, mask in enumerate(packed, start=1)}
+
+
+def unpack_matrix(rows, num_questions):
+    """Packed answers of many sheets -> (sheets x num_questions) uint8 masks; short rows are padded with blanks."""
+    matrix = np.zeros((len(rows), num_questions), dtype=np.uint8)
+    for i, packed in enumerate(rows):
+        if packed:
+            row = np.frombuffer(packed, dtype=np.uint8)[:num_questions]
+            matrix[i, :len(row)] = row
+    return matrix
+
+
+def pack_sections(section_scores):
+    """{"subject_1": n, ...} -> {column: n} for SECTION_COLUMNS (missing sections are None)."""
+    section_scores = section_scores or {}
+    return {name: section_scores.get(name) for name in SECTION_COLUMNS}
+
+
+def unpack_sections(values):
+    """Section column values in SECTION_COLUMNS order -> {"subject_1": n, ...}, or None if all are unset."""
+    values = list(values)
+    if all(v is None for v in values):
+        return None
+    return {name: v for name, v in zip(SECTION_COLUMNS, values) if v is not None}
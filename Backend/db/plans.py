@@ -0,0 +1,82 @@
+# backend/db/plans.py
+"""
+Query-plan checks for the hot lookups.
+
+explain() runs the database's EXPLAIN on a SQLAlchemy query (EXPLAIN QUERY
+PLAN on SQLite, EXPLAIN on PostgreSQL and others). check_plans() flags any
+hot query that scans a table instead of using an index. Run it against a
+real database after schema changes:
+
+  python -m Backend.db.plans                 # uses DATABASE_URL
+  python -m Backend.db.plans --strict        # exit 1 if any query scans a table
+"""
+import argparse
+import re
+import sys
+from datetime import datetime
+from . import crud
+from .database import SessionLocal, init_db
+
+# plan lines that mean "read the whole table"
+_FULL_SCAN = (
+    re.compile(r"^SCAN (?!.*\bUSING\b.*\bINDEX\b)", re.I),  # SQLite
+    re.compile(r"Seq Scan on \w+", re.I),                   # PostgreSQL
+)
+
+def explain(db, query):
+    """Plan lines for a Query, as reported by the database."""
+    bind = db.get_bind()
+    sql = str(query.statement.compile(dialect=bind.dialect, compile_kwargs={"literal_binds": True}))
+    if bind.dialect.name == "sqlite":
+        rows = db.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+        return [row[-1] for row in rows]
+    rows = db.connection().exec_driver_sql(f"EXPLAIN {sql}").fetchall()
+    return [" ".join(str(col) for col in row) for row in rows]
+
+def full_scans(plan):
+    """Plan lines that read a whole table."""
+    return [line for line in plan if any(p.search(line.strip()) for p in _FULL_SCAN)]
+
+def hot_queries(db):
+    """The lookups that must stay index-driven as results grow, by name."""
+    return {
+        "result_by_student": crud.query_result_by_student(db, "S0001"),
+        "result_by_hash": crud.query_result_by_hash(db, "0" * 64, "v1", "rev"),
+        "exam_phashes": crud.query_exam_phashes(db, 1, after_id=0),
+        "unreviewed_results": crud.query_unreviewed_results(db),
+        "results_page": crud.query_result_rows(
+            db, cursor=crud.encode_cursor(datetime(2024, 1, 1), 1000)).limit(100),
+        "exam_results_page": crud.query_result_rows(db, exam_id=1).limit(100),
+    }
+
+def check_plans(db):
+    """{name: (plan lines, full-scan lines)} for every hot query."""
+    report = {}
+    for name, query in hot_queries(db).items():
+        plan = explain(db, query)
+        report[name] = (plan, full_scans(plan))
+    return report
+
+def main():
+    p = argparse.ArgumentParser(description="Show query plans for the hot result lookups.")
+    p.add_argument("--strict", action="store_true", help="Exit 1 when any hot query scans a whole table")
+    args = p.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    try:
+        report = check_plans(db)
+    finally:
+        db.close()
+
+    bad = False
+    for name, (plan, scans) in report.items():
+        print(f"{name}: {'FULL SCAN' if scans else 'ok'}")
+        for line in plan:
+            print(f"    {line}")
+        bad = bad or bool(scans)
+    if args.strict and bad:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# backend/db/rescore.py
+"""
+Re-score stored results after an answer-key correction, without the images.
+
+Every result records the fingerprint of the key it was scored with
+(Result.key_fingerprint). Results already scored with the corrected key are
+skipped. For results scored with one of the known earlier keys, only the
+questions whose accepted options changed are looked at: the stored answer
+masks for those questions are checked against both keys, and the
+per-question differences (+1 now correct, -1 no longer correct) are added
+onto the stored section scores and total. Results scored with a key that
+isn't known (or before fingerprints were recorded) are scored in full with
+the new key from their stored answers.
+
+Each chunk is written with one bulk update that records the new key's
+fingerprint on every row read (so a repeated rescore skips them) and the new
+scores where they changed; the exam's score_bins are shifted from the old
+scores to the new ones, and one "rescored" audit entry records the chunk.
+Each chunk is its own transaction.
+"""
+import json
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from . import models, crud
+from .packing import SECTION_COLUMNS, pack_answers, pack_sections, unpack_matrix
+
+CHUNK = 5000
+
+
+def changed_questions(old_key, new_key):
+    """0-based indexes of the questions whose accepted options differ between two CompiledKeys."""
+    if old_key.num_questions != new_key.num_questions:
+        raise ValueError("Old and new answer keys have a different number of questions")
+    return np.flatnonzero(old_key.masks != new_key.masks)
+
+
+def _hits(answers, masks):
+    # same rule as CompiledKey.correct, for a subset of questions
+    return (answers != 0) & ((answers & ~masks) == 0) & ((answers & masks) != 0)
+
+
+def _query_chunk(db: Session, exam_id: int, version: str, fingerprint: str, after_id: int, chunk: int):
+    R = models.Result
+    return db.query(R.id, R.answers_packed, R.legacy_raw_answers, R.key_fingerprint, R.total_score,
+                    *crud.section_columns()) \
+        .filter(and_(R.exam_id == exam_id, R.version == version, R.id > after_id,
+                     or_(R.key_fingerprint.is_(None), R.key_fingerprint != fingerprint),
+                     or_(R.answers_packed.isnot(None), R.legacy_raw_answers.isnot(None)))) \
+        .order_by(R.id).limit(chunk).all()
+
+
+def rescore_results(db: Session, exam_id: int, version: str, new_key, known_keys=(),
+                    actor: Optional[str] = "system", chunk: int = CHUNK):
+    """
+    Bring every stored result of an exam version in line with new_key (a
+    CompiledKey). known_keys are earlier CompiledKeys results may have been
+    scored with; their results are updated from the changed questions only,
+    any other result is scored in full. Results with no stored answers are
+    left alone. Returns {"checked": rows read, "updated": rows whose scores
+    changed, "recomputed": rows scored in full, "questions": {key
+    fingerprint: changed question numbers}}.
+    """
+    deltas = {}
+    for key in known_keys:
+        if key is not None and key.fingerprint != new_key.fingerprint:
+            deltas[key.fingerprint] = (key, changed_questions(key, new_key))
+    summary = {"checked": 0, "updated": 0, "recomputed": 0,
+               "questions": {fp: (changed + 1).tolist() for fp, (_, changed) in deltas.items()}}
+    num_sections = len(SECTION_COLUMNS)
+
+    after_id = 0
+    while True:
+        rows = _query_chunk(db, exam_id, version, new_key.fingerprint, after_id, chunk)
+        if not rows:
+            break
+        after_id = rows[-1].id
+        summary["checked"] += len(rows)
+
+        packed = [row.answers_packed if row.answers_packed is not None else pack_answers(row.legacy_raw_answers)
+                  for row in rows]
+        answers = unpack_matrix(packed, new_key.num_questions)
+        old_sections = [crud.row_section_scores(row) for row in rows]
+        stored = np.array([[(s or {}).get(name, 0) or 0 for name in SECTION_COLUMNS] for s in old_sections],
+                          dtype=np.int32)
+        fingerprints = np.array([row.key_fingerprint or "" for row in rows])
+        scored = np.array([row.total_score is not None and bool(s) for row, s in zip(rows, old_sections)])
+
+        sections = stored.copy()
+        full = scored.copy()  # rows not covered by a known key are scored in full
+        for fp, (old_key, changed) in deltas.items():
+            sel = np.flatnonzero((fingerprints == fp) & scored)
+            full[sel] = False
+            if not len(sel) or not len(changed):
+                continue
+            # +1 / -1 per (sheet, changed question), summed into each section
+            part = answers[np.ix_(sel, changed)]
+            diff = _hits(part, new_key.masks[changed]).astype(np.int32) - _hits(part, old_key.masks[changed])
+            add = np.zeros((len(sel), num_sections), dtype=np.int32)
+            np.add.at(add.T, new_key.section_ids[changed], diff.T)
+            sections[sel] += add
+        full |= ~scored
+        if full.any():
+            sections[full] = new_key.score_batch(answers[full])[1]
+        summary["recomputed"] += int(full.sum())
+
+        # every row read is now scored with new_key; only changed scores move the histograms
+        changed_rows = ~scored | (sections != stored).any(axis=1)
+        updates, removed, added = [], [], []
+        for i, row in enumerate(rows):
+            mapping = dict(id=row.id, key_fingerprint=new_key.fingerprint)
+            if changed_rows[i]:
+                new_sections = dict(zip(SECTION_COLUMNS, sections[i].tolist()))
+                mapping.update(total_score=int(sections[i].sum()), **new_sections)
+                removed.append({"exam_id": exam_id, "total_score": row.total_score, "section_scores": old_sections[i]})
+                added.append({"exam_id": exam_id, "total_score": mapping["total_score"], "section_scores": new_sections})
+            if row.answers_packed is None:
+                # convert legacy rows on the way
+                mapping.update(answers_packed=packed[i], legacy_raw_answers=None, legacy_section_scores=None)
+                if not changed_rows[i]:
+                    mapping.update(pack_sections(old_sections[i]))
+            updates.append(mapping)
+
+        db.bulk_update_mappings(models.Result, updates)
+        crud.bump_score_bins(db, removed, sign=-1)
+        crud.bump_score_bins(db, added)
+        db.add(models.AuditLog(result_id=None, action="rescored", actor=actor, note=json.dumps({
+            "exam_id": exam_id, "version": version, "key": new_key.fingerprint,
+            "first_result_id": rows[0].id, "last_result_id": rows[-1].id,
+            "updated": len(removed), "recomputed": int(full.sum()),
+        })))
+        db.commit()
+        summary["updated"] += len(removed)
+    return summary
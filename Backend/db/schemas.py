@@ -1,6 +1,6 @@
 # backend/db/schemas.py
 from pydantic import BaseModel
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Union
 from datetime import datetime
 
 class StudentCreate(BaseModel):
@@ -46,6 +46,11 @@ class AnswerKey(BaseModel):
     class Config:
         orm_mode = True
 
+class Rescore(BaseModel):
+    version: str
+    key: Union[Dict[str, Any], List[Any]]  # corrected key, question -> option(s)
+    actor: Optional[str] = "system"
+
 class ResultCreate(BaseModel):
     student_id: Optional[int] = None
     uploaded_filename: str
@@ -54,7 +59,7 @@ class ResultCreate(BaseModel):
     version: Optional[str] = None
     total_score: Optional[int] = None
     section_scores: Optional[Dict[str,int]] = None
-    raw_answers: Optional[Dict[str,str]] = None
+    raw_answers: Optional[Dict[str,Optional[str]]] = None
     overlay_path: Optional[str] = None
 
 class Result(BaseModel):
@@ -66,7 +71,7 @@ class Result(BaseModel):
     version: Optional[str]
     total_score: Optional[int]
     section_scores: Optional[Dict[str,int]]
-    raw_answers: Optional[Dict[str,str]]
+    raw_answers: Optional[Dict[str,Optional[str]]]
     overlay_path: Optional[str]
     reviewed: bool
     created_at: datetime
@@ -0,0 +1,157 @@
+# backend/db/writer.py
+"""
+Write-behind buffer for graded results.
+
+Callers hand results to ResultWriter.submit() and get a Future back. A
+background thread collects them and writes each batch with
+crud.bulk_create_results, so many sheets share one transaction (and one
+fsync on SQLite) instead of paying several commits each. A batch is written
+once it reaches max_batch items or its oldest item has waited max_delay
+seconds, whichever comes first. Whatever queues up while a batch is being
+written goes into the next one, so under load batches grow on their own.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from . import crud
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class ResultWriter:
+    def __init__(self, session_factory=SessionLocal, max_batch=None, max_delay=None):
+        if max_batch is None:
+            max_batch = int(os.environ.get("OMR_WRITE_BATCH", "200"))
+        if max_delay is None:
+            max_delay = float(os.environ.get("OMR_WRITE_DELAY", "0.005"))
+        self.session_factory = session_factory
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.written = 0
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, payload, then=None):
+        """
+        Queue a result (crud.create_result payload). The returned Future
+        resolves to the new result id, or to then(result_id) when given; then
+        runs on the writer thread after the batch is committed.
+        """
+        future = Future()
+        self._ensure_started()
+        self._queue.put(("result", payload, then, future))
+        return future
+
+    def log(self, result_id, action, actor="system", note=None):
+        """Queue a standalone audit entry; it is written with the next batch."""
+        future = Future()
+        self._ensure_started()
+        self._queue.put(("audit", dict(result_id=result_id, action=action, actor=actor, note=note), None, future))
+        return future
+
+    def flush(self):
+        """Block until everything queued so far has been written."""
+        future = Future()
+        self._ensure_started()
+        self._queue.put(("flush", None, None, future))
+        return future.result()
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def stats(self):
+        return {"pending": self._queue.qsize(), "batches": self.batches, "written": self.written,
+                "max_batch": self.max_batch, "max_delay": self.max_delay}
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            stop = False
+            while len(batch) < self.max_batch and batch[-1][0] != "flush":
+                # take whatever is already queued, then linger until the deadline
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                self._write(batch)
+            except Exception as e:
+                # e.g. no database connection: fail this batch, keep the thread alive
+                logger.exception("Could not write a batch of %d items", len(batch))
+                for item in batch:
+                    if not item[3].done():
+                        item[3].set_exception(e)
+            if stop:
+                return
+
+    def _write(self, batch):
+        results = [item for item in batch if item[0] == "result"]
+        audits = [item for item in batch if item[0] == "audit"]
+        db = self.session_factory()
+        try:
+            try:
+                ids = crud.bulk_create_results(db, [item[1] for item in results], [item[1] for item in audits])
+            except Exception:
+                # one bad row shouldn't fail the whole batch: retry item by item
+                db.rollback()
+                logger.exception("Bulk write of %d results failed; retrying individually", len(results))
+                ids = self._write_individually(db, results, audits)
+        finally:
+            db.close()
+        self.batches += 1
+        self.written += sum(1 for i in ids if not isinstance(i, Exception))
+
+        for (_, _, then, future), result_id in zip(results, ids):
+            if isinstance(result_id, Exception):
+                future.set_exception(result_id)
+                continue
+            try:
+                future.set_result(then(result_id) if then else result_id)
+            except Exception as e:
+                future.set_exception(e)
+        for item in audits:
+            item[3].set_result(None)
+        for item in batch:
+            if item[0] == "flush":
+                item[3].set_result(None)
+
+    @staticmethod
+    def _write_individually(db, results, audits):
+        ids = []
+        for item in results:
+            try:
+                ids.append(crud.create_result(db, item[1]).id)
+            except Exception as e:
+                db.rollback()
+                ids.append(e)
+        for item in audits:
+            try:
+                crud.create_audit_log(db, **item[1])
+            except Exception:
+                db.rollback()
+                logger.exception("Could not write audit entry %r", item[1])
+        return ids
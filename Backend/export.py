@@ -0,0 +1,83 @@
+# backend/export.py
+
+"""
+Streaming CSV / XLSX export of graded results.
+
+Rows come from crud.query_result_rows through yield_per (a server-side
+cursor where the driver supports one), so only one batch of rows is held at
+a time. CSV is sent as it is produced. XLSX is written by openpyxl in
+write-only mode to a temporary file, which is then streamed; an XLSX can't
+be sent until its zip directory is written.
+"""
+
+import csv
+import io
+import os
+import tempfile
+
+from .db import crud
+
+NUM_SUBJECTS = 5
+EXPORT_COLUMNS = (["result_id", "student_id", "exam_code", "version", "total_score"]
+                  + [f"subject_{i}" for i in range(1, NUM_SUBJECTS + 1)]
+                  + ["reviewed", "created_at"])
+FETCH_SIZE = 1000
+CHUNK_BYTES = 64 * 1024
+
+FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx"),
+}
+
+
+def iter_export_rows(session_factory, exam_id=None, version=None):
+    """Yield export rows (lists in EXPORT_COLUMNS order); owns its session."""
+    db = session_factory()
+    try:
+        query = crud.query_result_rows(db, exam_id, version) \
+            .execution_options(stream_results=True).yield_per(FETCH_SIZE)
+        for row in query:
+            sections = crud.row_section_scores(row) or {}
+            yield ([row.id, row.student_id, row.exam_code, row.version, row.total_score]
+                   + [sections.get(f"subject_{i}") for i in range(1, NUM_SUBJECTS + 1)]
+                   + [bool(row.reviewed), row.created_at.isoformat() if row.created_at else None])
+    finally:
+        db.close()
+
+
+def stream_csv(rows):
+    """CSV bytes in ~CHUNK_BYTES pieces, header first."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= CHUNK_BYTES:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def stream_xlsx(rows):
+    """Write-only XLSX built in a temp file, then streamed in CHUNK_BYTES pieces."""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    sheet = wb.create_sheet("results")
+    sheet.append(EXPORT_COLUMNS)
+    for row in rows:
+        sheet.append(row)
+    fd, path = tempfile.mkstemp(prefix="omr_export_", suffix=".xlsx")
+    os.close(fd)
+    try:
+        wb.save(path)
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
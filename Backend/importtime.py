@@ -0,0 +1,78 @@
+"""
+backend/importtime.py
+
+Startup-time report: runs `python -X importtime` on a module in a fresh
+interpreter and lists the most expensive imports (cumulative, in ms), plus any
+heavy optional backends that got pulled in eagerly.
+
+Usage examples (from project root):
+  python -m Backend.importtime
+  python -m Backend.importtime --module Backend.omr.processor --top 30
+  python -m Backend.importtime --budget-ms 800      # exit 1 when over budget
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# backends that should only load on first use (PDF rendering, ML, TF)
+LAZY_MODULES = ("pdf2image", "PIL", "sklearn", "tensorflow", "pandas", "openpyxl", "pyarrow")
+
+
+def measure(module):
+    """
+    Import `module` in a child interpreter. Returns (rows, total_ms) where rows
+    are (name, self_ms, cumulative_ms, depth) in import order.
+    """
+    env = dict(os.environ)
+    # keep the report side-effect free: no stray sqlite file in the cwd
+    env.setdefault("DATABASE_URL", "sqlite://")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr.strip()}")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # header line
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(parts[0]) / 1000.0, int(parts[1]) / 1000.0, depth))
+    total_ms = sum(cum for _, _, cum, depth in rows if depth == 0)
+    return rows, total_ms
+
+
+def main():
+    p = argparse.ArgumentParser(description="Report per-module import cost of the backend.")
+    p.add_argument("--module", default="Backend.app", help="Module to import (default: %(default)s)")
+    p.add_argument("--top", type=int, default=20, help="Rows to show (default: %(default)s)")
+    p.add_argument("--budget-ms", type=float, default=None,
+                   help="Fail (exit 1) when the total import time exceeds this")
+    args = p.parse_args()
+
+    rows, total_ms = measure(args.module)
+
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for name, self_ms, cum_ms, _ in sorted(rows, key=lambda r: r[2], reverse=True)[:args.top]:
+        print(f"{cum_ms:14.1f} {self_ms:9.1f}  {name}")
+    print(f"\nTotal: {total_ms:.1f} ms for {len(rows)} modules")
+
+    loaded = {name.split(".")[0] for name, _, _, _ in rows}
+    eager = [m for m in LAZY_MODULES if m in loaded]
+    if eager:
+        print("Loaded eagerly (expected lazy): " + ", ".join(eager))
+
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f"Over budget: {total_ms:.1f} ms > {args.budget_ms:.1f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
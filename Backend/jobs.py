@@ -0,0 +1,124 @@
+# backend/jobs.py
+
+"""
+Small in-process job queue for CPU-bound OMR work.
+
+The OpenCV pipeline is synchronous and can take a noticeable amount of time per
+sheet. Running it inside an `async def` endpoint blocks the event loop, so the
+API hands the work to a JobManager instead: submit() returns immediately with a
+job id, a thread pool does the work, and clients poll or wait on the job.
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job:
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+
+    def to_dict(self):
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == DONE:
+            data["result"] = self.result
+        elif self.status == FAILED:
+            data["error"] = self.error
+        return data
+
+
+class JobManager:
+    def __init__(self, max_workers=None, max_finished=1000):
+        """
+        max_workers: threads running jobs (default: OMR_JOB_WORKERS or CPU count)
+        max_finished: how many finished jobs to keep around for polling
+        """
+        self.max_workers = max_workers or int(os.environ.get("OMR_JOB_WORKERS", os.cpu_count() or 1))
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="omr-job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) and return its Job straight away."""
+        job = Job(uuid.uuid4().hex)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._counts[QUEUED] += 1
+        job.future = self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        self._set_status(job, RUNNING)
+        job.started_at = time.time()
+        try:
+            job.result = fn(*args, **kwargs)
+        except Exception as e:
+            job.error = str(e)
+            job.finished_at = time.time()
+            self._set_status(job, FAILED)
+            raise
+        job.finished_at = time.time()
+        self._set_status(job, DONE)
+        return job.result
+
+    def _set_status(self, job, status):
+        with self._lock:
+            self._counts[job.status] -= 1
+            self._counts[status] += 1
+            job.status = status
+            if status in (DONE, FAILED):
+                self._prune()
+
+    def _prune(self):
+        # drop the oldest finished jobs once we hold more than max_finished
+        finished = self._counts[DONE] + self._counts[FAILED]
+        if finished <= self.max_finished:
+            return
+        for job_id in list(self._jobs):
+            job = self._jobs[job_id]
+            if job.status in (DONE, FAILED):
+                del self._jobs[job_id]
+                self._counts[job.status] -= 1
+                finished -= 1
+                if finished <= self.max_finished:
+                    break
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._counts[QUEUED],
+                "in_flight": self._counts[RUNNING],
+                "done": self._counts[DONE],
+                "failed": self._counts[FAILED],
+                "max_workers": self.max_workers,
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -8,28 +8,37 @@ Usage:
     clf = BubbleClassifier()
     clf.train(train_images, train_labels)   # optional if you have data
     pred = clf.predict(cropped_roi)         # returns 1 if filled, 0 if empty
+    preds = clf.predict_batch(roi_stack)    # (N, 20, 20) stack -> (N,) array of 0/1
+    clf.save("bubble_clf.npz")
+
+    clf = BubbleClassifier.load("bubble_clf.npz")   # NumPy only, no scikit-learn import
+
+Saved models are plain .npz arrays (scaler mean/scale, logistic coef/intercept,
+classes), so inference is a NumPy dot product. scikit-learn is only imported
+to train. Workers should use load_shared(), which loads a file once per process
+(and, when loaded before the worker pool forks, once for all workers).
 """
 
+import hashlib
+import os
 import numpy as np
-from sklearn.linear_model import LogisticRegression
-from sklearn.preprocessing import StandardScaler
-from sklearn.pipeline import make_pipeline
 import cv2
 
+MODEL_FORMAT_VERSION = 1
+
+# path -> (mtime, BubbleClassifier) for load_shared
+_shared_models = {}
+
 class BubbleClassifier:
-    def _init_(self, model=None):
+    def __init__(self, model=None):
         """
-        If no model provided, create a LogisticRegression pipeline.
+        If no model provided, a StandardScaler + LogisticRegression pipeline
+        is created when train() is first called.
         """
-        if model is None:
-            self.model = make_pipeline(
-                StandardScaler(),
-                LogisticRegression(max_iter=200)
-            )
-            self.is_trained = False
-        else:
-            self.model = model
-            self.is_trained = True
+        self.model = model
+        self.is_trained = model is not None
+        # (mean, scale, coef, intercept, classes) when inference can run in NumPy
+        self._linear = self._extract_linear(model) if model is not None else None
 
     def preprocess_roi(self, roi):
         """
@@ -44,17 +53,104 @@ class BubbleClassifier:
         normed = resized.astype(np.float32) / 255.0
         return normed.flatten()
 
+    def preprocess_batch(self, rois):
+        """
+        Feature matrix (N, 400) for a stacked ROI tensor: (N, 20, 20) grayscale
+        or (N, 20, 20, 3) BGR, e.g. from utils.sample_rois. Stacks of another
+        size, or a list of ragged ROIs, go through preprocess_roi one by one.
+        """
+        if isinstance(rois, np.ndarray) and rois.ndim in (3, 4) and rois.shape[1:3] == (20, 20):
+            stack = rois
+            if stack.ndim == 4:
+                stack = stack.mean(axis=3)  # close enough to BGR2GRAY for a 0..1 feature
+            return (stack.reshape(len(stack), -1).astype(np.float32) / 255.0)
+        return np.array([self.preprocess_roi(roi) for roi in rois], dtype=np.float32).reshape(-1, 400)
+
     def train(self, roi_list, labels):
         """
         Train classifier.
         roi_list: list of numpy arrays (cropped bubble images)
         labels: list/array of 0 (empty) or 1 (filled)
         """
+        if self.model is None:
+            from sklearn.linear_model import LogisticRegression
+            from sklearn.preprocessing import StandardScaler
+            from sklearn.pipeline import make_pipeline
+            self.model = make_pipeline(
+                StandardScaler(),
+                LogisticRegression(max_iter=200)
+            )
         X = [self.preprocess_roi(roi) for roi in roi_list]
         X = np.array(X)
         y = np.array(labels)
         self.model.fit(X, y)
         self.is_trained = True
+        self._linear = self._extract_linear(self.model)
+
+    @staticmethod
+    def _extract_linear(model):
+        """
+        Pull scaler + logistic parameters out of a fitted (StandardScaler,)
+        LogisticRegression model; None for anything else.
+        """
+        steps = [step for _, step in getattr(model, "steps", [(None, model)])]
+        clf = steps[-1]
+        if not hasattr(clf, "coef_") or not hasattr(clf, "intercept_"):
+            return None
+        n_features = clf.coef_.shape[1]
+        mean = np.zeros(n_features)
+        scale = np.ones(n_features)
+        for step in steps[:-1]:
+            if not (hasattr(step, "mean_") and hasattr(step, "scale_")):
+                return None
+            mean = step.mean_ if step.mean_ is not None else mean
+            scale = step.scale_ if step.scale_ is not None else scale
+        return (np.asarray(mean, dtype=np.float32), np.asarray(scale, dtype=np.float32),
+                np.asarray(clf.coef_, dtype=np.float32), np.asarray(clf.intercept_, dtype=np.float32),
+                np.asarray(clf.classes_))
+
+    @property
+    def fingerprint(self):
+        """Short digest of the model parameters (None when not a linear model)."""
+        if self._linear is None:
+            return None
+        digest = hashlib.sha1()
+        for arr in self._linear:
+            digest.update(np.ascontiguousarray(arr).tobytes())
+        return digest.hexdigest()[:16]
+
+    def _predict_features(self, features):
+        if self._linear is None:
+            return np.asarray(self.model.predict(features))
+        mean, scale, coef, intercept, classes = self._linear
+        scores = ((features - mean) / scale) @ coef.T + intercept
+        if scores.shape[1] == 1:
+            return classes[(scores[:, 0] > 0).astype(int)]
+        return classes[np.argmax(scores, axis=1)]
+
+    def save(self, path):
+        """Write the trained model as a NumPy-only .npz file."""
+        if not self.is_trained or self._linear is None:
+            raise ValueError("Only a trained (StandardScaler +) LogisticRegression model can be saved")
+        mean, scale, coef, intercept, classes = self._linear
+        with open(path, "wb") as f:
+            np.savez(f, format_version=np.array(MODEL_FORMAT_VERSION), mean=mean, scale=scale,
+                     coef=coef, intercept=intercept, classes=classes)
+
+    @classmethod
+    def load(cls, path):
+        """Load a model written by save(); does not import scikit-learn."""
+        with np.load(path, allow_pickle=False) as data:
+            version = int(data["format_version"])
+            if version != MODEL_FORMAT_VERSION:
+                raise ValueError(f"Unsupported bubble model format {version} in {path}")
+            params = tuple(data[name] for name in ("mean", "scale", "coef", "intercept", "classes"))
+        for arr in params:
+            arr.setflags(write=False)
+        clf = cls()
+        clf.is_trained = True
+        clf._linear = params
+        return clf
 
     def predict(self, roi):
         """
@@ -65,7 +161,20 @@ class BubbleClassifier:
             return self._threshold_fallback(roi)
 
         features = self.preprocess_roi(roi).reshape(1, -1)
-        return int(self.model.predict(features)[0])
+        return int(self._predict_features(features)[0])
+
+    def predict_batch(self, rois):
+        """
+        Predict 0 (empty) / 1 (filled) for a whole stack of ROIs with a single
+        model call. Returns an int array of length N.
+        """
+        features = self.preprocess_batch(rois)
+        if len(features) == 0:
+            return np.zeros(0, dtype=int)
+        if not self.is_trained:
+            # same rule as _threshold_fallback: dark-pixel ratio above 0.15
+            return ((features < 128 / 255.0).mean(axis=1) > 0.15).astype(int)
+        return self._predict_features(features).astype(int)
 
     def _threshold_fallback(self, roi):
         """
@@ -77,4 +186,17 @@ class BubbleClassifier:
         gray = roi if len(roi.shape) == 2 else cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
         norm = cv2.resize(gray, (20, 20))
         filled_ratio = np.count_nonzero(norm < 128) / float(norm.size)
-        return 1 if filled_ratio > 0.15 else 0
\ No newline at end of file
+        return 1 if filled_ratio > 0.15 else 0
+
+def load_shared(path):
+    """
+    Process-wide cached BubbleClassifier.load(path). The parameters are
+    read-only, so one instance can be shared by every sheet a process grades
+    and, via fork, by every worker started after it was loaded.
+    """
+    path = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+    cached = _shared_models.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = _shared_models[path] = (mtime, BubbleClassifier.load(path))
+    return cached[1]
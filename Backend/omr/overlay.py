@@ -0,0 +1,83 @@
+# backend/omr/overlay.py
+
+"""
+Overlay rendering, kept off the grading hot path.
+
+Grading only records an overlay *spec*: the sheet corners in the source image,
+the size the sheet was warped to, and the centers of the chosen bubbles in
+warped coordinates. From that and the original image the overlay can be
+re-created exactly whenever somebody actually asks for it.
+"""
+
+import cv2
+import numpy as np
+
+# format name -> (file extension, cv2 encode params builder)
+FORMATS = {
+    "png": (".png", lambda q: [cv2.IMWRITE_PNG_COMPRESSION, 3]),
+    "jpg": (".jpg", lambda q: [cv2.IMWRITE_JPEG_QUALITY, q]),
+    "jpeg": (".jpg", lambda q: [cv2.IMWRITE_JPEG_QUALITY, q]),
+    "webp": (".webp", lambda q: [cv2.IMWRITE_WEBP_QUALITY, q]),
+}
+
+MEDIA_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".webp": "image/webp"}
+
+
+def overlay_spec(corners, size, marks):
+    """
+    JSON-friendly description of an overlay.
+    corners: ordered (tl, tr, br, bl) sheet corners in the source image
+    size: (width, height) of the warped sheet
+    marks: (N, 2) centers of the chosen bubbles in warped coordinates
+    """
+    return {
+        "corners": np.asarray(corners, dtype=np.float32).round(2).tolist(),
+        "size": [int(size[0]), int(size[1])],
+        "marks": np.asarray(marks, dtype=np.int32).reshape(-1, 2).tolist(),
+    }
+
+
+def draw_marks(warped, marks):
+    overlay = warped.copy()
+    for cx, cy in marks:
+        cv2.circle(overlay, (int(cx), int(cy)), 15, (0,255,0), 2)
+    return overlay
+
+
+def warp_from_spec(image, spec):
+    width, height = spec["size"]
+    rect = np.array(spec["corners"], dtype="float32")
+    dst = np.array([
+        [0, 0],
+        [width - 1, 0],
+        [width - 1, height - 1],
+        [0, height - 1]
+    ], dtype="float32")
+    M = cv2.getPerspectiveTransform(rect, dst)
+    return cv2.warpPerspective(image, M, (width, height))
+
+
+def encode_image(image, fmt="png", quality=85):
+    """Encode to bytes; returns (data, extension)."""
+    fmt = fmt.lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported overlay format '{fmt}'")
+    ext, params = FORMATS[fmt]
+    ok, buf = cv2.imencode(ext, image, params(int(quality)))
+    if not ok:
+        raise ValueError(f"Could not encode overlay as {fmt}")
+    return buf.tobytes(), ext
+
+
+def render_overlay(image, spec, fmt="png", quality=85, max_dim=None):
+    """
+    Re-create an overlay from the source image and its spec, optionally
+    shrunk so its longest side is at most max_dim. Returns (data, extension).
+    """
+    overlay = draw_marks(warp_from_spec(image, spec), spec["marks"])
+    if max_dim:
+        h, w = overlay.shape[:2]
+        scale = max_dim / float(max(h, w))
+        if scale < 1.0:
+            overlay = cv2.resize(overlay, (int(w*scale), int(h*scale)), interpolation=cv2.INTER_AREA)
+    return encode_image(overlay, fmt, quality)
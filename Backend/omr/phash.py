@@ -0,0 +1,141 @@
+# backend/omr/phash.py
+
+"""
+Perceptual fingerprints of warped sheets, for spotting re-photographed pages.
+
+sheet_phash() takes the perspective-corrected grayscale sheet, equalizes its
+histogram (so exposure and contrast changes cancel out), shrinks it to 64x64
+and keeps the signs of the lowest 8 vertical x 16 horizontal DCT
+frequencies against their median: a 128-bit hash. The thresholded sheet is
+not used because adaptive thresholding amplifies JPEG noise and lighting
+changes. A (nearly) flat warp, e.g. a blank frame, has no hash: equalizing
+it would only stretch noise.
+
+Calibration, through OMRProcessor.process_image (detection, warp, hash) on
+the sample photos (A/ and B/) against copies downscaled to 70% or 50% and
+recompressed, recompressed at JPEG quality 40, brightened, rotated by 1.5-2
+degrees or with added noise: copies of the same sheet were at most 30 bits
+apart, different sheets at least 40. MAX_DISTANCE sits between the two.
+Rescans that aren't re-aligned by the sheet detection (framing shifted by
+several percent) can land further apart than that, so a match is only a
+hint ("possible_rescan"). Recalibrate with OMR_RESCAN_MAX_DISTANCE on real
+rescans.
+
+PHashIndex keeps each hash as two uint64 words and answers "which stored
+sheets are within N bits of this one" exactly, with one vectorized XOR /
+popcount over all of them (about 0.4 ms for 50k sheets on one core).
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+HASH_SIZE = 64      # side the sheet is shrunk to before the DCT
+HASH_ROWS = 8       # vertical frequencies kept
+HASH_COLS = 16      # horizontal frequencies kept
+HASH_BITS = HASH_ROWS * HASH_COLS
+HASH_WORDS = HASH_BITS // 64
+# default "likely rescan" distance, in bits (see the calibration above)
+MAX_DISTANCE = 35
+# warps with less gray-level spread than this are not hashed (sample sheets: 18+)
+MIN_CONTRAST = 5.0
+
+
+def sheet_phash(sheet):
+    """128-bit perceptual hash (as an int) of a warped grayscale sheet; None if the sheet is flat."""
+    if sheet.size == 0 or sheet.std() < MIN_CONTRAST:
+        return None
+    small = cv2.resize(cv2.equalizeHist(sheet), (HASH_SIZE, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    freqs = cv2.dct(small.astype(np.float32))[:HASH_ROWS, :HASH_COLS].ravel()
+    # the DC term only measures overall ink, leave it out of the median
+    bits = freqs > np.median(freqs[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def to_hex(phash):
+    return format(phash, f"0{HASH_BITS // 4}x")
+
+
+def from_hex(value):
+    return int(value, 16)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _words(phash):
+    # HASH_BITS-bit int -> HASH_WORDS uint64 words, most significant first
+    return np.frombuffer(phash.to_bytes(HASH_BITS // 8, "big"), dtype=">u8").astype(np.uint64)
+
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+_1, _2, _4, _56 = (np.uint64(n) for n in (1, 2, 4, 56))
+
+
+def _distances(words, query):
+    """
+    Hamming distance from query (HASH_WORDS,) to every column of words
+    (HASH_WORDS, n): XOR, then a SWAR popcount done in place, with the words
+    of each hash summed before the final byte fold.
+    """
+    x = words ^ query[:, None]
+    t = x >> _1
+    t &= _M1
+    x -= t
+    t = x >> _2
+    t &= _M2
+    x &= _M2
+    x += t
+    t = x >> _4
+    x += t
+    x &= _M4  # per-byte counts (<= 8); summed over the words they stay <= 128, so the fold can't carry
+    total = x[0].copy()
+    for row in x[1:]:
+        total += row
+    total *= _H01
+    total >>= _56
+    return total
+
+
+class PHashIndex:
+    """Exact Hamming-distance index over (id, phash) pairs; thread-safe."""
+
+    def __init__(self, capacity=1024):
+        self._lock = threading.Lock()
+        # one row per hash word, one column per stored hash
+        self._words = np.zeros((HASH_WORDS, capacity), dtype=np.uint64)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._known = set()
+        self._size = 0
+        # highest id added, so callers can load only newer rows
+        self.max_id = 0
+
+    def add(self, item_id, phash):
+        with self._lock:
+            if item_id in self._known:
+                return
+            if self._size == len(self._ids):
+                self._words = np.concatenate([self._words, np.zeros_like(self._words)], axis=1)
+                self._ids = np.concatenate([self._ids, np.zeros_like(self._ids)])
+            self._words[:, self._size] = _words(phash)
+            self._ids[self._size] = item_id
+            self._size += 1
+            self._known.add(item_id)
+            self.max_id = max(self.max_id, item_id)
+
+    def query(self, phash, max_distance=MAX_DISTANCE, exclude=None):
+        """[(id, distance)] of stored hashes within max_distance bits, nearest first."""
+        with self._lock:
+            distances = _distances(self._words[:, :self._size], _words(phash))
+            hits = np.flatnonzero(distances <= max_distance)
+            matches = [(int(self._ids[i]), int(distances[i])) for i in hits if self._ids[i] != exclude]
+        matches.sort(key=lambda m: (m[1], m[0]))
+        return matches
+
+    def __len__(self):
+        return self._size
@@ -2,28 +2,139 @@
 
 import cv2
 import numpy as np
+import hashlib
 import json
 import os
 import tempfile
-from .utils import load_image, to_grayscale, save_image
-from .pdf_utils import pdf_to_images
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from .utils import load_image, to_grayscale, save_image, fill_ratios, sample_rois
+from .pdf_utils import iter_pdf_pages, pdf_page_info
+from .template import load_template
+from .overlay import overlay_spec, draw_marks
+from .scoring import AnswerKeyStore
+from .classifier import load_shared as load_classifier
+from .phash import sheet_phash, to_hex
+
+# minimum fill ratio for a bubble to count as marked
+FILL_THRESHOLD = 0.15
+# fill ratios in this open interval are re-checked by the classifier, if any
+UNCERTAINTY_BAND = (0.10, 0.25)
+OPTIONS = ['A','B','C','D','E']
+# smallest bubble candidate, as cv2.contourArea of its outline
+MIN_BUBBLE_AREA = 100
+_CROSS = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+# smallest sheet outline accepted, as a fraction of the searched image's area
+MIN_SHEET_AREA = 0.2
+# bump when a change to the pipeline can change results for the same image
+PIPELINE_REVISION = 2
+
+# Per-process OMRProcessor used by batch workers (see process_batch)
+_worker_processor = None
+
+def _init_worker(kwargs):
+    global _worker_processor
+    # one process per core already; keep OpenCV from spawning its own threads
+    cv2.setNumThreads(1)
+    _worker_processor = OMRProcessor(**kwargs)
+
+def _process_in_worker(index, source, version, student_id, overlay_path, answer_key=None):
+    try:
+        res = _worker_processor.process(source, version=version, student_id=student_id, overlay_path=overlay_path,
+                                        answer_key=answer_key)
+    except Exception as e:
+        return {"index": index, "student_id": student_id, "version": version, "error": str(e)}
+    res["index"] = index
+    return res
+
+def _process_page_in_worker(pdf_path, page, dpi, version, student_id, answer_key=None):
+    # each worker renders its own page, so rendering runs in parallel too
+    try:
+        pages = iter_pdf_pages(pdf_path, dpi=dpi, first_page=page, last_page=page)
+        try:
+            _, img = next(pages)
+        except StopIteration:
+            raise ValueError(f"Page {page} could not be rendered")
+        finally:
+            pages.close()
+        res = _worker_processor.process_image(img, version, student_id=student_id, answer_key=answer_key)
+    except Exception as e:
+        return {"page": page, "student_id": student_id, "version": version, "error": str(e)}
+    res["page"] = page
+    return res
 
 class OMRProcessor:
-    def __init__(self, templates_dir=None, answer_key_path=None):
+    def __init__(self, templates_dir=None, answer_key_path=None, max_workers=None, template=None,
+                 detect_max_dim=None, eager_overlay=None, classifier=None, uncertainty_band=None,
+                 classifier_path=None):
+        """
+        template: name (in templates_dir) or path of a fixed-layout sheet
+        template, e.g. "template_v1". When set, bubbles are sampled from the
+        template's precompiled coordinates instead of being found by contour
+        search. Defaults to the OMR_TEMPLATE environment variable, if any.
+        detect_max_dim: longest side of the image pyramid level used to find
+        the sheet outline (default OMR_DETECT_MAX_DIM or 1024; 0 disables).
+        eager_overlay: draw and save the overlay PNG next to path inputs during
+        grading (default OMR_EAGER_OVERLAY, off). Otherwise results only carry
+        an overlay spec that omr.overlay can render later.
+        classifier: optional BubbleClassifier used to settle ambiguous bubbles,
+        those whose fill ratio falls inside uncertainty_band (lo, hi); all of a
+        sheet's ambiguous bubbles go through one predict_batch call.
+        classifier_path: saved classifier (.npz, see BubbleClassifier.save) to
+        use instead of an instance (default OMR_CLASSIFIER_PATH). It is loaded
+        once per process, before the batch pool forks, and shared read-only.
+        """
         base = os.path.dirname(__file__)
         self.templates_dir = templates_dir or os.path.join(base, "templates")
+        self.template_name = template or os.environ.get("OMR_TEMPLATE") or None
+        self.template = load_template(self.template_name, self.templates_dir) if self.template_name else None
+        # sheet corners are searched on a pyramid level no larger than this (0 = full resolution)
+        if detect_max_dim is None:
+            detect_max_dim = int(os.environ.get("OMR_DETECT_MAX_DIM", "1024"))
+        self.detect_max_dim = detect_max_dim
+        if eager_overlay is None:
+            eager_overlay = os.environ.get("OMR_EAGER_OVERLAY", "0") == "1"
+        self.eager_overlay = eager_overlay
         # If sample data includes an answer_keys.json, pass path in
-        self.answer_keys = self._load_answer_keys(answer_key_path)
+        self.answer_key_path = answer_key_path
+        # keys are compiled per version on first use and reloaded when the file changes
+        self.answer_keys = AnswerKeyStore(lambda: self._load_answer_keys(answer_key_path),
+                                          path=self._answer_key_file(answer_key_path))
+        classifier_path = classifier_path or os.environ.get("OMR_CLASSIFIER_PATH") or None
+        if classifier is None and classifier_path:
+            classifier = load_classifier(classifier_path)
+        self.classifier = classifier
+        self.uncertainty_band = tuple(uncertainty_band or UNCERTAINTY_BAND)
+        # worker pool for process_batch, created on first use
+        self._worker_kwargs = dict(templates_dir=self.templates_dir, answer_key_path=answer_key_path,
+                                   template=self.template_name, detect_max_dim=self.detect_max_dim,
+                                   eager_overlay=self.eager_overlay,
+                                   uncertainty_band=self.uncertainty_band)
+        # workers re-use the shared model by path rather than receiving a copy
+        if classifier_path:
+            self._worker_kwargs["classifier_path"] = classifier_path
+        else:
+            self._worker_kwargs["classifier"] = classifier
+        self.max_workers = max_workers or int(os.environ.get("OMR_BATCH_WORKERS", os.cpu_count() or 1))
+        self._pool = None
+        self._pool_lock = threading.Lock()
     
-    def _load_answer_keys(self, answer_key_path):
-        # priority: provided path, then sample_data folder, then templates
+    def _answer_key_file(self, answer_key_path):
+        # priority: provided path, then sample_data folder
         if answer_key_path and os.path.exists(answer_key_path):
-            with open(answer_key_path, 'r') as f:
-                return json.load(f)
+            return answer_key_path
         # default sample_data/answer_keys.json relative to project root
         default_path = os.path.join(os.path.dirname(base:=os.path.dirname(__file__)), "sample_data", "answer_keys.json")
         if os.path.exists(default_path):
-            with open(default_path, 'r') as f:
+            return default_path
+        return None
+    
+    def _load_answer_keys(self, answer_key_path):
+        # priority: provided path, then sample_data folder, then templates
+        key_file = self._answer_key_file(answer_key_path)
+        if key_file:
+            with open(key_file, 'r') as f:
                 return json.load(f)
         # fallback: template in templates
         template_k = os.path.join(self.templates_dir, "template_v1.json")
@@ -36,62 +147,290 @@ class OMRProcessor:
         # fallback demo
         return { "v1": ["A"]*20 + ["B"]*20 + ["C"]*20 + ["D"]*20 + ["A"]*20 }
     
-    def process(self, file_path: str, version: str = "v1", student_id: str = None):
+    def revision(self, version, answer_key=None):
+        """
+        Short id of everything besides the image that decides a result for
+        this version: pipeline, template, detection size, classifier and the
+        compiled answer key (answer_key if given, else the version's key).
+        Stored results are only reused for the same id. Raises ValueError for
+        unknown versions.
         """
-        Accepts an image or PDF. If PDF, converts to images and processes first page (or all pages).
+        key = answer_key if answer_key is not None else self.answer_keys.get(version)
+        classifier = None
+        if self.classifier is not None:
+            classifier = getattr(self.classifier, "fingerprint", None) or type(self.classifier).__name__
+        parts = [
+            PIPELINE_REVISION,
+            self.template.revision if self.template is not None else "contour",
+            self.detect_max_dim,
+            classifier,
+            self.uncertainty_band if classifier else None,
+            key.fingerprint,
+        ]
+        return hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest()[:16]
+
+    def process(self, source, version: str = "v1", student_id: str = None, overlay_path: str = None,
+                answer_key=None):
+        """
+        Accepts an image or PDF, either as a file path or in memory (bytes,
+        bytearray, memoryview or a binary file object, decoded without touching
+        disk). If PDF, renders pages one at a time (resolution chosen from the
+        template, if any) and processes the first page; see process_stack()
+        for PDFs holding one student per page.
+        overlay_path: render the overlay now and save it there. Without it the
+        overlay is only rendered for path input when eager_overlay is on.
+        answer_key: CompiledKey to score with instead of the version's key
+        from the key file (e.g. an exam's corrected key).
         """
-        ext = os.path.splitext(file_path)[1].lower()
+        if hasattr(source, "read"):
+            source = source.read()
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            is_pdf = bytes(source[:5]) == b"%PDF-"
+        else:
+            is_pdf = os.path.splitext(source)[1].lower() == ".pdf"
         
-        image_paths = []
-        if ext == ".pdf":
-            # convert
-            tmpdir = tempfile.mkdtemp(prefix="omr_pdf_")
-            image_paths = pdf_to_images(file_path, tmpdir)
-            if not image_paths:
-                raise ValueError("PDF conversion failed or produced no images")
+        if is_pdf:
+            # pages are rendered lazily; closing the iterator removes its temp files
+            pages = iter_pdf_pages(source, template=self.template)
         else:
-            image_paths = [file_path]
+            pages = iter([(1, source)])
         
         # process the first image (or optionally all pages)
         results = []
-        for img_path in image_paths:
-            try:
-                res = self.process_image(img_path, version, student_id=student_id)
-            except Exception as e:
-                # log error, but continue with other pages or bubble up
-                raise
+        try:
+            for _, img in pages:
+                try:
+                    res = self.process_image(img, version, student_id=student_id, overlay_path=overlay_path,
+                                             answer_key=answer_key)
+                except Exception as e:
+                    # log error, but continue with other pages or bubble up
+                    raise
+            
+                results.append(res)
+                # if just single sheet per student, break
+                break
+        finally:
+            if is_pdf:
+                pages.close()
         
-            results.append(res)
-            # if just single sheet per student, break
-            break
+        if not results:
+            raise ValueError("PDF conversion failed or produced no images")
         
         # return first result
         return results[0]
     
-    def process_image(self, img_path, version='v1', student_id: str = None):
+    def process_batch(self, sources, version: str = "v1", student_ids=None, overlay_paths=None, window=None,
+                      answer_key=None):
+        """
+        Grades many sheets in parallel across a pool of worker processes.
+        sources are anything process() accepts (paths or in-memory bytes), in
+        any iterable; it is consumed lazily, so at most `window` sheets
+        (default: twice the worker count) are loaded and in flight at a time.
+        Yields one dict per sheet as soon as it finishes (completion order, not
+        submission order). Each dict carries the `index` of its source and
+        either the usual process() fields or an `error` message, so one bad
+        sheet does not abort the batch. Closing the generator cancels the
+        sheets that haven't started. answer_key is passed on to process().
+        """
+        student_ids = list(student_ids) if student_ids else []
+        overlay_paths = list(overlay_paths) if overlay_paths else []
+        window = window or 2 * self.max_workers
+        pool = self._get_pool()
+        sources = enumerate(sources)
+        pending = set()
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < window:
+                    try:
+                        i, source = next(sources)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    sid = student_ids[i] if i < len(student_ids) else None
+                    overlay_path = overlay_paths[i] if i < len(overlay_paths) else None
+                    pending.add(pool.submit(_process_in_worker, i, source, version, sid, overlay_path, answer_key))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield fut.result()
+        finally:
+            for fut in pending:
+                fut.cancel()
+    
+    def process_stack(self, pdf, version: str = "v1", student_ids=None, window=None, answer_key=None):
         """
-        Main image → answers pipeline. Returns dict with
+        Grades a multi-student PDF stack where every page is a separate sheet.
+        pdf is a path or raw bytes. Pages are rendered and graded in parallel
+        on the worker pool and yielded in page order, each as a dict with its
+        `page` number and either the process_image() fields or an `error`
+        message (a bad page does not abort the stack). At most `window` pages
+        (default: twice the worker count) are in flight at a time. answer_key
+        is passed on to process_image().
+        The PDF is opened before this returns the page iterator, so a file
+        that isn't a readable PDF raises ValueError here rather than while
+        the pages are being consumed.
+        """
+        tmpdir = tempfile.TemporaryDirectory(prefix="omr_stack_")
+        try:
+            if isinstance(pdf, (bytes, bytearray, memoryview)):
+                # workers render from a file, so spill in-memory stacks once
+                pdf_path = os.path.join(tmpdir.name, "stack.pdf")
+                with open(pdf_path, "wb") as f:
+                    f.write(pdf)
+            else:
+                pdf_path = str(pdf)
+            page_count, dpi = pdf_page_info(pdf_path, self.template)
+        except BaseException:
+            tmpdir.cleanup()
+            raise
+        return self._grade_stack_pages(tmpdir, pdf_path, page_count, dpi, version, student_ids, window, answer_key)
+    
+    def _grade_stack_pages(self, tmpdir, pdf_path, page_count, dpi, version, student_ids, window, answer_key):
+        # the generator behind process_stack; tmpdir goes when it finishes or is closed
+        student_ids = list(student_ids) if student_ids else []
+        window = window or 2 * self.max_workers
+        with tmpdir:
+            pool = self._get_pool()
+            pending = deque()
+            next_page = 1
+            try:
+                while next_page <= page_count or pending:
+                    while next_page <= page_count and len(pending) < window:
+                        sid = student_ids[next_page-1] if next_page <= len(student_ids) else None
+                        pending.append(pool.submit(_process_page_in_worker, pdf_path, next_page, dpi, version, sid,
+                                                   answer_key))
+                        next_page += 1
+                    yield pending.popleft().result()
+            finally:
+                for fut in pending:
+                    fut.cancel()
+    
+    def _get_pool(self):
+        # concurrent first batches must not each start (and leak) a pool
+        pool = self._pool
+        if pool is None:
+            with self._pool_lock:
+                pool = self._pool
+                if pool is None:
+                    pool = self._pool = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        initializer=_init_worker,
+                        initargs=(self._worker_kwargs,),
+                    )
+        return pool
+    
+    def close(self):
+        """Shut down the batch worker pool, if one was started."""
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+    
+    def process_image(self, source, version='v1', student_id: str = None, overlay_path: str = None,
+                      answer_key=None):
+        """
+        Main image → answers pipeline. source is a path, encoded image bytes or
+        a decoded BGR array. answer_key: CompiledKey to score with instead of
+        the version's key. Returns dict with
         total_score, section_scores, raw answers, overlay etc.
         """
-        img = load_image(img_path)
+        if answer_key is None:
+            # compiled once per version; raises for unknown versions / short keys
+            answer_key = self.answer_keys.get(version)
+        
+        img = load_image(source)
         if img is None:
-            raise ValueError(f"Unable to read image from {img_path}")
+            where = source if isinstance(source, (str, os.PathLike)) else "in-memory upload"
+            raise ValueError(f"Unable to read image from {where}")
         
-        # Preprocessing:
+        # Find the sheet (coarse-to-fine when detect_max_dim is set)
+        corners = self._detect_sheet(img)
+        
+        if self.template is not None:
+            # fixed layout: warp straight to the template size and sample its bubble index
+            warped = self._four_point_transform(img, corners, size=self.template.sheet_size)
+            warped_gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
+            thresh = self._threshold(warped_gray)
+            fill_scores = self._fill_scores(thresh, warped_gray, self.template.rois)
+            answers, marks, answer_masks = self._pick_answers(fill_scores, self.template.centers, self.template.options)
+        else:
+            # limit the max dimension of the standard sheet used for bubble
+            # detection; applied inside the warp so the image is resampled once
+            warped = self._four_point_transform(img, corners, max_dim=2000)
+            warped_gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
+            
+            # Thresholding
+            thresh = self._threshold(warped_gray)
+            
+            # Find bubbles
+            bubbles = self._find_bubbles(thresh)
+            
+            answers, marks, answer_masks = self._extract_answers(thresh, bubbles, warped_gray)
+        
+        # Scoring
+        total, section_scores = answer_key.score(answer_masks)
+        # fingerprint of the normalized sheet, to spot re-photographed pages
+        # (None for a flat warp, which is then never matched as a rescan)
+        phash = sheet_phash(warped_gray)
+        
+        # the overlay itself is deferred: keep the warp and the chosen bubbles
+        overlay = overlay_spec(self._order_points(corners), (warped.shape[1], warped.shape[0]), marks)
+        if overlay_path is None and self.eager_overlay and isinstance(source, (str, os.PathLike)):
+            overlay_path = os.path.splitext(source)[0] + "_overlay.png"
+        if overlay_path:
+            save_image(overlay_path, draw_marks(warped, overlay["marks"]))
+        
+        return {
+            "student_id": student_id,
+            "version": version,
+            "total_score": total,
+            "section_scores": section_scores,
+            "answers": answers,
+            "overlay_path": overlay_path,
+            "overlay": overlay,
+            "phash": to_hex(phash) if phash is not None else None,
+            # identifies the exact key the sheet was scored with (see db/rescore.py)
+            "key_fingerprint": answer_key.fingerprint,
+        }
+    
+    def _detect_sheet(self, img):
+        """
+        Returns the sheet's four corners (float32, full-resolution coordinates).
+        The edge/contour search runs on a pyrDown level no larger than
+        detect_max_dim; the corners found there are scaled back up and refined
+        locally with cornerSubPix on the full-resolution image. Falls back to
+        the image corners when no quadrilateral covers at least MIN_SHEET_AREA
+        of the searched image.
+        """
         gray = to_grayscale(img)
+        small = gray
+        scale = 1
+        if self.detect_max_dim:
+            while max(small.shape[:2]) > self.detect_max_dim:
+                small = cv2.pyrDown(small)
+                scale *= 2
+        
+        # Preprocessing:
         # maybe apply histogram equalization if lighting uneven
-        gray = cv2.equalizeHist(gray)
-        blurred = cv2.GaussianBlur(gray, (5,5), 0)
+        small = cv2.equalizeHist(small)
+        blurred = cv2.GaussianBlur(small, (5,5), 0)
         edged = cv2.Canny(blurred, 50, 150)
         
         # Find contour of sheet
-        contours, _ = cv2.findContours(edged.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours, _ = cv2.findContours(edged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         if not contours:
             raise ValueError("No contours found in image")
         
         contours = sorted(contours, key=cv2.contourArea, reverse=True)
+        # small blobs (bubbles, print) simplify to quadrilaterals too, at any
+        # scale; the sheet should fill a fair share of the frame
+        min_area = MIN_SHEET_AREA * small.shape[0] * small.shape[1]
         sheet_cnt = None
         for c in contours:
+            if cv2.contourArea(c) < min_area:
+                break
             peri = cv2.arcLength(c, True)
             approx = cv2.approxPolyDP(c, 0.02 * peri, True)
             if len(approx) == 4:
@@ -101,73 +440,52 @@ class OMRProcessor:
         if sheet_cnt is None:
             # fallback: use full image corners
             h, w = img.shape[:2]
-            sheet_cnt = np.array([[[0,0]], [[w-1,0]], [[w-1,h-1]], [[0,h-1]]])
-        
-        warped = self._four_point_transform(img, sheet_cnt.reshape(4,2))
-        warped_gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
-        
-        # optional: resize to standard size for bubble detection
-        # e.g. limit max dimension
-        max_dim = 2000
-        h2, w2 = warped_gray.shape
-        scale = min(max_dim / max(h2,w2), 1.0)
-        if scale < 1.0:
-            warped_gray = cv2.resize(warped_gray, (int(w2*scale), int(h2*scale)))
-            warped = cv2.resize(warped, (int(w2*scale), int(h2*scale)))
-        
-        # Thresholding
-        thresh = cv2.adaptiveThreshold(warped_gray, 255,
-                                       cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                       cv2.THRESH_BINARY_INV, 25, 10)
-        
-        # Find bubbles
-        bubbles = self._find_bubbles(thresh)
-        
-        answers, overlay = self._extract_answers(warped, thresh, bubbles)
-        
-        # Scoring
-        if version not in self.answer_keys:
-            raise ValueError(f"Unknown version '{version}' in answer_keys")
-        answer_key = self.answer_keys[version]
+            return np.array([[0,0], [w-1,0], [w-1,h-1], [0,h-1]], dtype="float32")
         
-        if len(answer_key) < 100:
-            raise ValueError(f"Answer key for version '{version}' must have 100 entries (found {len(answer_key)})")
-        
-        section_scores = {}
-        total = 0
-        for s in range(5):
-            start = s * 20
-            end = start + 20
-            score = 0
-            for i in range(start, end):
-                pred = answers.get(i+1)
-                if pred is not None and pred == answer_key[i]:
-                    score += 1
-            section_scores[f"subject_{s+1}"] = score
-            total += score
-        
-        overlay_path = os.path.splitext(img_path)[0] + "_overlay.png"
-        save_image(overlay_path, overlay)
-        
-        return {
-            "student_id": student_id,
-            "version": version,
-            "total_score": total,
-            "section_scores": section_scores,
-            "answers": answers,
-            "overlay_path": overlay_path
-        }
+        corners = sheet_cnt.reshape(4,2).astype("float32") * scale
+        if scale > 1:
+            corners = self._refine_corners(gray, corners, scale)
+        return corners
+    
+    def _refine_corners(self, gray, corners, scale):
+        """
+        Sub-pixel refinement of coarse corners in a window sized to the pyramid
+        scale. A corner that drifts further than the coarse level's uncertainty
+        (e.g. onto nearby print) keeps its coarse position.
+        """
+        h, w = gray.shape[:2]
+        win = max(int(scale * 2), 3)
+        pts = corners.copy()
+        pts[:, 0] = np.clip(pts[:, 0], win + 1, w - win - 2)
+        pts[:, 1] = np.clip(pts[:, 1], win + 1, h - win - 2)
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.1)
+        refined = cv2.cornerSubPix(gray, pts.reshape(-1,1,2).copy(), (win, win), (-1, -1), criteria).reshape(4,2)
+        drift = np.linalg.norm(refined - corners, axis=1)
+        return np.where((drift <= 2 * scale)[:, None], refined, corners).astype("float32")
+    
+    def _threshold(self, gray):
+        return cv2.adaptiveThreshold(gray, 255,
+                                     cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                     cv2.THRESH_BINARY_INV, 25, 10)
     
-    def _four_point_transform(self, image, pts):
+    def _four_point_transform(self, image, pts, size=None, max_dim=None):
         rect = self._order_points(pts)
-        (tl, tr, br, bl) = rect
-        widthA = np.linalg.norm(br - bl)
-        widthB = np.linalg.norm(tr - tl)
-        maxWidth = int(max(widthA, widthB))
-        
-        heightA = np.linalg.norm(tr - br)
-        heightB = np.linalg.norm(tl - bl)
-        maxHeight = int(max(heightA, heightB))
+        if size is not None:
+            maxWidth, maxHeight = size
+        else:
+            (tl, tr, br, bl) = rect
+            widthA = np.linalg.norm(br - bl)
+            widthB = np.linalg.norm(tr - tl)
+            maxWidth = int(max(widthA, widthB))
+            
+            heightA = np.linalg.norm(tr - br)
+            heightB = np.linalg.norm(tl - bl)
+            maxHeight = int(max(heightA, heightB))
+            
+            if max_dim:
+                scale = min(max_dim / max(maxWidth, maxHeight), 1.0)
+                if scale < 1.0:
+                    maxWidth, maxHeight = int(maxWidth*scale), int(maxHeight*scale)
         
         dst = np.array([
             [0, 0],
@@ -193,83 +511,130 @@ class OMRProcessor:
         return rect
     
     def _find_bubbles(self, thresh_img):
-        cnts, _ = cv2.findContours(thresh_img.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        bubble_contours = []
-        for c in cnts:
-            (x, y, w, h) = cv2.boundingRect(c)
-            ar = w / float(h) if h != 0 else 0
-            area = cv2.contourArea(c)
-            # Heuristics: aspect ratio near 1, size reasonable relative to sheet
-            if 15 < w < 100 and 15 < h < 100 and 0.7 <= ar <= 1.3 and area > 100:
-                bubble_contours.append((x, y, w, h, c))
-        bubble_contours = sorted(bubble_contours, key=lambda b: (b[1], b[0]))
-        return bubble_contours
+        """
+        Bubble candidates as an (N, 4) int array of x, y, w, h sorted by (y, x).
+        Holes are filled first so every connected component covers the same
+        region an external contour would (a mark inside a ring belongs to that
+        ring); the size / aspect heuristics then run as masks over the
+        component stats.
+        
+        The area heuristic is on cv2.contourArea of the external contour, as
+        it always was, not on the pixel count: the contour runs through the
+        centers of the boundary pixels, so its area is the pixel count less
+        half the contour's length less one. The length is at most four steps
+        per boundary pixel, so components that clear the threshold even at
+        that bound are kept as they are; only the few borderline ones have
+        their contour traced.
+        """
+        padded = cv2.copyMakeBorder(thresh_img, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+        cv2.floodFill(padded, None, (0, 0), 255)
+        holes = cv2.bitwise_not(padded)[1:-1, 1:-1]
+        filled = cv2.bitwise_or(thresh_img, holes)
+        
+        n, labels, stats, _ = cv2.connectedComponentsWithStats(filled, connectivity=8)
+        w = stats[:, cv2.CC_STAT_WIDTH]
+        h = stats[:, cv2.CC_STAT_HEIGHT]
+        pixels = stats[:, cv2.CC_STAT_AREA]
+        ar = w / np.maximum(h, 1).astype(np.float32)
+        # Heuristics: aspect ratio near 1, size reasonable relative to sheet
+        keep = (w > 15) & (w < 100) & (h > 15) & (h < 100) & (ar >= 0.7) & (ar <= 1.3) & (pixels > MIN_BUBBLE_AREA + 1)
+        keep[0] = False  # label 0 is the background
+        
+        # boundary pixels: 4-adjacent to the background (or the image edge)
+        eroded = cv2.erode(filled, _CROSS, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+        boundary = np.bincount(labels[filled > eroded], minlength=n)
+        for i in np.flatnonzero(keep & (pixels - 2 * boundary - 1 <= MIN_BUBBLE_AREA)).tolist():
+            keep[i] = self._contour_area(labels, stats[i], i) > MIN_BUBBLE_AREA
+        
+        boxes = stats[keep, :4]
+        return boxes[np.lexsort((boxes[:, 0], boxes[:, 1]))]
+    
+    def _contour_area(self, labels, stat, label):
+        # cv2.contourArea of one component's external contour
+        x, y, w, h = stat[:4]
+        mask = (labels[y:y+h, x:x+w] == label).astype(np.uint8)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return cv2.contourArea(contours[0])
+    
+    def _fill_scores(self, thresh, gray, rects):
+        """
+        Fill ratio per bubble for (questions, options, 4) rects. With a
+        classifier, bubbles inside the uncertainty band are resampled from the
+        gray sheet as one 20x20 stack and classified in a single batch; filled
+        ones are raised to the top of the band, empty ones dropped to its bottom.
+        """
+        fill_scores = fill_ratios(thresh, rects)
+        if self.classifier is None or gray is None:
+            return fill_scores
+        lo, hi = self.uncertainty_band
+        unsure = (fill_scores > lo) & (fill_scores < hi)
+        if not unsure.any():
+            return fill_scores
+        filled = self.classifier.predict_batch(sample_rois(gray, rects[unsure])).astype(bool)
+        fill_scores[unsure] = np.where(filled, hi, lo)
+        return fill_scores
     
-    def _extract_answers(self, warped_color, thresh, bubble_contours):
+    def _pick_answers(self, fill_scores, centers, options=OPTIONS):
+        """
+        Turn a (questions x options) fill matrix into the answers dict, the
+        (N, 2) centers of the chosen bubbles and per-question answer bitmasks
+        (see omr.scoring). centers: (questions, options, 2).
+        """
+        rows = np.arange(fill_scores.shape[0])
+        chosen = np.argmax(fill_scores, axis=1)
+        marked = fill_scores[rows, chosen] > FILL_THRESHOLD
+        
         answers = {}
-        overlay = warped_color.copy()
+        for q, (idx, is_marked) in enumerate(zip(chosen.tolist(), marked.tolist())):
+            answers[q+1] = options[idx] if is_marked else None
         
-        centers = []
-        for (x, y, w, h, c) in bubble_contours:
-            cx = x + w/2
-            cy = y + h/2
-            centers.append(((cx, cy), (x, y, w, h)))
-        if not centers:
-            return answers, overlay
+        answer_masks = np.where(marked, np.left_shift(1, chosen), 0).astype(np.uint8)
+        return answers, centers[rows, chosen][marked], answer_masks
+    
+    def _extract_answers(self, thresh, bubbles, gray=None):
+        """
+        bubbles: (N, 4) x, y, w, h array from _find_bubbles. Groups bubbles into
+        rows (centers within 25px of the row's first center), then each row into
+        runs of 5 options, and scores the first 100 groups.
+        """
+        if len(bubbles) == 0:
+            return {}, np.zeros((0, 2), dtype=np.float32), np.zeros(0, dtype=np.uint8)
         
-        centers_sorted = sorted(centers, key=lambda x: (x[0][1], x[0][0]))
+        boxes = np.asarray(bubbles, dtype=np.int32)
+        cx = boxes[:, 0] + boxes[:, 2] / 2.0
+        cy = boxes[:, 1] + boxes[:, 3] / 2.0
+        order = np.lexsort((cx, cy))
+        boxes, cx, cy = boxes[order], cx[order], cy[order]
         
-        rows = []
-        current_row = [centers_sorted[0]]
-        row_y = centers_sorted[0][0][1]
-        for center in centers_sorted[1:]:
-            if abs(center[0][1] - row_y) < 25:  # row threshold
-                current_row.append(center)
-            else:
-                rows.append(current_row)
-                current_row = [center]
-                row_y = center[0][1]
-        rows.append(current_row)
+        # rows: a new row starts once a center is 25px or more below the row's first center
+        row_ids = np.empty(len(cy), dtype=np.int32)
+        row = 0
+        row_y = cy[0]
+        for i, y in enumerate(cy.tolist()):
+            if abs(y - row_y) >= 25:  # row threshold
+                row += 1
+                row_y = y
+            row_ids[i] = row
         
         # sort each row by x
-        for i in range(len(rows)):
-            rows[i] = sorted(rows[i], key=lambda x: x[0][0])
+        order = np.lexsort((cx, row_ids))
+        boxes, cx, cy, row_ids = boxes[order], cx[order], cy[order], row_ids[order]
         
-        qnum = 1
-        for r in rows:
-            # process groups of 5 (choices A-E) in each row
-            for i in range(0, len(r), 5):
-                group = r[i:i+5]
-                if len(group) != 5:
-                    continue
-                fill_scores = []
-                for (cxcy, bbox) in group:
-                    (x, y, w, h) = bbox
-                    # pad a little inside bbox for ROI
-                    pad = int(min(w, h) * 0.1)
-                    x0 = int(x + pad)
-                    y0 = int(y + pad)
-                    x1 = int(x + w - pad)
-                    y1 = int(y + h - pad)
-                    roi = thresh[y0:y1, x0:x1]
-                    if roi.size == 0:
-                        fill_scores.append(0)
-                    else:
-                        fill_scores.append(np.count_nonzero(roi) / float(roi.size))
-                chosen_idx = int(np.argmax(fill_scores))
-                chosen_score = fill_scores[chosen_idx]
-                # threshold for marking
-                if chosen_score > 0.15:
-                    answers[qnum] = ['A','B','C','D','E'][chosen_idx]
-                    # draw overlay circle
-                    cx, cy = int(group[chosen_idx][0][0]), int(group[chosen_idx][0][1])
-                    cv2.circle(overlay, (cx, cy), 15, (0,255,0), 2)
-                else:
-                    answers[qnum] = None
-                qnum += 1
-                if qnum > 100:
-                    break
-            if qnum > 100:
-                break
+        # groups of 5 (choices A-E) in each row; a short trailing group is skipped
+        row_sizes = np.bincount(row_ids)
+        row_starts = np.concatenate(([0], np.cumsum(row_sizes)[:-1]))
+        pos = np.arange(len(row_ids)) - row_starts[row_ids]
+        in_group = pos < (row_sizes[row_ids] // 5) * 5
+        n_groups = min(int(in_group.sum()) // 5, 100)
+        if n_groups == 0:
+            return {}, np.zeros((0, 2), dtype=np.float32), np.zeros(0, dtype=np.uint8)
+        
+        # (questions, 5, 4) boxes, padded a little inside each bbox for the ROI
+        grouped = boxes[in_group][:n_groups * 5].reshape(n_groups, 5, 4)
+        x, y, w, h = grouped[..., 0], grouped[..., 1], grouped[..., 2], grouped[..., 3]
+        pad = (np.minimum(w, h) * 0.1).astype(np.int32)
+        rects = np.stack([x + pad, y + pad, x + w - pad, y + h - pad], axis=-1)
+        centers = np.stack([cx, cy], axis=-1)[in_group][:n_groups * 5].reshape(n_groups, 5, 2)
         
-        return answers, overlay
+        fill_scores = self._fill_scores(thresh, gray, rects)
+        return self._pick_answers(fill_scores, centers)
@@ -0,0 +1,157 @@
+# backend/omr/scoring.py
+
+"""
+Compiled answer keys and vectorized scoring.
+
+Answers and keys are both stored as one uint8 bitmask per question (bit i set
+= option i marked / accepted), so scoring a sheet, or a whole (sheets x
+questions) matrix, is a couple of NumPy array operations. Keys are compiled
+once per version and recompiled only when their source file changes.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+OPTION_LETTERS = "ABCDEFGH"
+NUM_SECTIONS = 5
+SECTION_SIZE = 20
+
+
+def option_mask(value):
+    """
+    Bitmask for one key entry: a letter ("B"), several letters ("A,C"), an
+    option index (1), or a list of either. Empty / unknown entries give 0.
+    """
+    if value is None:
+        return 0
+    if isinstance(value, (list, tuple)):
+        mask = 0
+        for v in value:
+            mask |= option_mask(v)
+        return mask
+    if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+        return 1 << int(value) if 0 <= value < len(OPTION_LETTERS) else 0
+    mask = 0
+    for part in str(value).replace(",", " ").split():
+        part = part.strip().upper()
+        if part in OPTION_LETTERS and len(part) == 1:
+            mask |= 1 << OPTION_LETTERS.index(part)
+    return mask
+
+
+class CompiledKey:
+    def __init__(self, version, masks, section_size=SECTION_SIZE, num_sections=NUM_SECTIONS):
+        self.version = version
+        self.masks = np.asarray(masks, dtype=np.uint8)
+        self.num_questions = len(self.masks)
+        self.section_names = [f"subject_{s+1}" for s in range(num_sections)]
+        # section s covers questions [starts[s], starts[s] + section_size)
+        self.section_starts = np.arange(num_sections) * section_size
+        self.section_ids = np.minimum(np.arange(self.num_questions) // section_size, num_sections - 1)
+        self._scored = self.section_starts < self.num_questions
+
+    @property
+    def fingerprint(self):
+        """Short digest of the accepted options; changes whenever the key does."""
+        return hashlib.sha1(self.masks.tobytes()).hexdigest()[:16]
+
+    def _fit(self, answer_masks):
+        # pad / trim answers (..., n) to the key length; missing questions are blank
+        answer_masks = np.asarray(answer_masks, dtype=np.uint8)
+        n = answer_masks.shape[-1]
+        if n == self.num_questions:
+            return answer_masks
+        if n > self.num_questions:
+            return answer_masks[..., :self.num_questions]
+        pad = [(0, 0)] * (answer_masks.ndim - 1) + [(0, self.num_questions - n)]
+        return np.pad(answer_masks, pad)
+
+    def correct(self, answer_masks):
+        """Boolean (..., questions): marked, and every marked option accepted."""
+        answer_masks = self._fit(answer_masks)
+        return (answer_masks != 0) & ((answer_masks & ~self.masks) == 0) & ((answer_masks & self.masks) != 0)
+
+    def score_batch(self, answer_masks):
+        """
+        Score a (sheets x questions) matrix in one go.
+        Returns (totals (sheets,), section_scores (sheets, sections)).
+        """
+        hits = self.correct(np.atleast_2d(answer_masks)).astype(np.int32)
+        sections = np.add.reduceat(hits, self.section_starts[self._scored], axis=1)
+        if sections.shape[1] < len(self.section_starts):
+            sections = np.pad(sections, [(0, 0), (0, len(self.section_starts) - sections.shape[1])])
+        return sections.sum(axis=1), sections
+
+    def score(self, answer_masks):
+        """Score one sheet; returns (total, {"subject_1": n, ...})."""
+        totals, sections = self.score_batch(answer_masks)
+        return int(totals[0]), dict(zip(self.section_names, sections[0].tolist()))
+
+
+def compile_key(version, key, num_questions=NUM_SECTIONS * SECTION_SIZE):
+    """
+    Compile an answer key: a list of entries in question order, or a dict
+    keyed by question number ("1".."100"; other keys are ignored).
+    """
+    if isinstance(key, dict):
+        entries = {}
+        for q, value in key.items():
+            if str(q).isdigit():
+                entries[int(q)] = value
+        masks = [option_mask(entries.get(q)) for q in range(1, num_questions + 1)]
+        found = sum(1 for q in entries if 1 <= q <= num_questions)
+    else:
+        masks = [option_mask(v) for v in list(key)[:num_questions]]
+        found = len(masks)
+    if found < num_questions:
+        raise ValueError(f"Answer key for version '{version}' must have {num_questions} entries (found {found})")
+    return CompiledKey(version, masks)
+
+
+class AnswerKeyStore:
+    def __init__(self, loader, path=None, check_interval=1.0):
+        """
+        loader: callable returning {version: raw key}
+        path: file the keys come from; when set, its mtime is checked (at most
+        every check_interval seconds) and keys are reloaded when it changes.
+        """
+        self._loader = loader
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._compiled = {}
+        self._mtime = self._stat()
+        self._checked_at = time.monotonic()
+        self.raw = loader()
+
+    def _stat(self):
+        try:
+            return os.path.getmtime(self.path) if self.path else None
+        except OSError:
+            return None
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if not self.path or now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        mtime = self._stat()
+        if mtime is not None and mtime != self._mtime:
+            self.raw = self._loader()
+            self._compiled = {}
+            self._mtime = mtime
+
+    def get(self, version):
+        """Compiled key for a version; raises ValueError for unknown versions."""
+        with self._lock:
+            self._maybe_reload()
+            key = self._compiled.get(version)
+            if key is None:
+                if version not in self.raw:
+                    raise ValueError(f"Unknown version '{version}' in answer_keys")
+                key = self._compiled[version] = compile_key(version, self.raw[version])
+            return key
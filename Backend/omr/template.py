@@ -0,0 +1,119 @@
+# backend/omr/template.py
+
+"""
+Fixed-layout sheet templates.
+
+A template JSON (see templates/template_v1.json) describes where the bubbles
+sit on a sheet once it has been warped to `sheet_size`. SheetTemplate compiles
+that description into an array of bubble rectangles once, so grading a sheet is
+just a warp to the template size plus one vectorized sampling pass, with no
+per-sheet contour search.
+
+Metadata used (all in warped-sheet pixels):
+- num_questions, options_per_question, questions_per_subject
+- bubble_size {width, height}, spacing {x, y}, start_offset {x, y}
+- column_spacing: x distance between subject columns
+  (default: options_per_question + 2 bubble spacings)
+- sheet_size {width, height}: size the sheet is warped to before sampling
+"""
+
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from .scoring import OPTION_LETTERS
+
+
+class SheetTemplate:
+    def __init__(self, data, name=None):
+        meta = data.get("metadata", {})
+        self.name = name or data.get("version", "template")
+        self.version = data.get("version")
+        # digest of the template contents, part of every cached result's key
+        self.revision = hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16]
+        layout = meta.get("layout", "grid")
+        if layout != "grid":
+            raise ValueError(f"Unsupported template layout '{layout}'")
+
+        self.num_questions = int(meta.get("num_questions", 100))
+        self.num_options = int(meta.get("options_per_question", 5))
+        self.questions_per_subject = int(meta.get("questions_per_subject", 20))
+        self.options = list(OPTION_LETTERS[:self.num_options])
+
+        bubble = meta.get("bubble_size", {})
+        spacing = meta.get("spacing", {})
+        offset = meta.get("start_offset", {})
+        self.bubble_w = int(bubble.get("width", 20))
+        self.bubble_h = int(bubble.get("height", 20))
+        self.spacing_x = int(spacing.get("x", 30))
+        self.spacing_y = int(spacing.get("y", 40))
+        self.start_x = int(offset.get("x", 0))
+        self.start_y = int(offset.get("y", 0))
+        self.column_spacing = int(meta.get("column_spacing", (self.num_options + 2) * self.spacing_x))
+
+        size = meta.get("sheet_size")
+        if size:
+            self.sheet_width = int(size["width"])
+            self.sheet_height = int(size["height"])
+        else:
+            # tight canvas around the grid plus the start offset as margin
+            subjects = -(-self.num_questions // self.questions_per_subject)
+            self.sheet_width = 2 * self.start_x + (subjects - 1) * self.column_spacing \
+                + (self.num_options - 1) * self.spacing_x + self.bubble_w
+            self.sheet_height = 2 * self.start_y + (self.questions_per_subject - 1) * self.spacing_y + self.bubble_h
+
+        self.rois, self.centers = self._compile()
+
+    def _compile(self):
+        """
+        Build the bubble index: rois (Q, O, 4) int32 rectangles x0, y0, x1, y1
+        (padded 10% inside the bubble, like the contour pipeline) and centers
+        (Q, O, 2) float32.
+        """
+        q = np.arange(self.num_questions)
+        o = np.arange(self.num_options)
+        subject = q // self.questions_per_subject
+        row = q % self.questions_per_subject
+
+        x = self.start_x + subject[:, None] * self.column_spacing + o[None, :] * self.spacing_x
+        y = np.broadcast_to((self.start_y + row * self.spacing_y)[:, None], x.shape)
+
+        pad = int(min(self.bubble_w, self.bubble_h) * 0.1)
+        rois = np.stack([
+            x + pad,
+            y + pad,
+            x + self.bubble_w - pad,
+            y + self.bubble_h - pad,
+        ], axis=-1).astype(np.int32)
+        centers = np.stack([x + self.bubble_w / 2.0, y + self.bubble_h / 2.0], axis=-1).astype(np.float32)
+        return rois, centers
+
+    @property
+    def sheet_size(self):
+        return (self.sheet_width, self.sheet_height)
+
+
+@lru_cache(maxsize=None)
+def _load_template_file(path, mtime):
+    with open(path, "r") as f:
+        data = json.load(f)
+    return SheetTemplate(data, name=os.path.splitext(os.path.basename(path))[0])
+
+
+def load_template(name_or_path, templates_dir=None):
+    """
+    Load and compile a template by file path or by name inside templates_dir
+    (e.g. "template_v1"). Compiled templates are cached per file revision.
+    """
+    path = name_or_path
+    if not os.path.exists(path) and templates_dir:
+        path = os.path.join(templates_dir, name_or_path)
+        if not path.endswith(".json"):
+            path += ".json"
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Template not found: {name_or_path}")
+    path = os.path.abspath(path)
+    return _load_template_file(path, os.path.getmtime(path))
@@ -1,13 +1,66 @@
 import cv2
 import numpy as np
-from pdf2image import convert_from_path
-from PIL import Image
 
-def load_image(path):
-    return cv2.imread(path)
+def load_image(source):
+    """
+    Load a BGR image from a file path, encoded image bytes (bytes, bytearray,
+    memoryview), a binary file object, or pass through an already decoded array.
+    Returns None if the data can't be decoded.
+    """
+    if isinstance(source, np.ndarray):
+        return source
+    if hasattr(source, "read"):
+        source = source.read()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return decode_image(source)
+    return cv2.imread(str(source))
+
+def decode_image(data):
+    """Decode encoded image bytes in memory with cv2.imdecode."""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if buf.size == 0:
+        return None
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
 
 def to_grayscale(image):
     return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
 def save_image(path, image):
     cv2.imwrite(path, image)
+
+
+def fill_ratios(binary_img, rects):
+    """
+    Fraction of non-zero pixels inside each rectangle of a binary image.
+    rects: integer array (..., 4) of x0, y0, x1, y1 (x1/y1 exclusive).
+    Uses a single integral image, so the cost does not depend on how many
+    rectangles are sampled. Returns a float32 array of shape rects.shape[:-1].
+    """
+    h, w = binary_img.shape[:2]
+    rects = np.asarray(rects)
+    x0 = np.clip(rects[..., 0], 0, w)
+    y0 = np.clip(rects[..., 1], 0, h)
+    x1 = np.clip(rects[..., 2], x0, w)
+    y1 = np.clip(rects[..., 3], y0, h)
+    integral = cv2.integral((binary_img > 0).astype(np.uint8), sdepth=cv2.CV_32S)
+    counts = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    area = (x1 - x0) * (y1 - y0)
+    return np.divide(counts, area, out=np.zeros(area.shape, dtype=np.float32), where=area > 0).astype(np.float32)
+
+def sample_rois(gray, rects, size=20):
+    """
+    Resample every rectangle of a grayscale image to size x size with one
+    cv2.remap call. rects: (N, 4) x0, y0, x1, y1. Returns (N, size, size) uint8.
+    """
+    rects = np.asarray(rects, dtype=np.float32).reshape(-1, 4)
+    n = len(rects)
+    if n == 0:
+        return np.zeros((0, size, size), dtype=np.uint8)
+    steps = (np.arange(size, dtype=np.float32) + 0.5) / size
+    xs = rects[:, 0:1] + steps[None, :] * (rects[:, 2:3] - rects[:, 0:1]) - 0.5
+    ys = rects[:, 1:2] + steps[None, :] * (rects[:, 3:4] - rects[:, 1:2]) - 0.5
+    map_x = np.broadcast_to(xs[:, None, :], (n, size, size)).reshape(n * size, size)
+    map_y = np.broadcast_to(ys[:, :, None], (n, size, size)).reshape(n * size, size)
+    out = cv2.remap(gray, np.ascontiguousarray(map_x), np.ascontiguousarray(map_y),
+                    cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return out.reshape(n, size, size)
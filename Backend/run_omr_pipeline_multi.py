@@ -1,48 +1,174 @@
-import pandas as pd
+"""
+Score student responses against the Set A / Set B answer keys.
+
+Responses are read in chunks (CSV, Parquet, or XLSX in read-only mode) and
+scored column by column with vectorized comparisons against every set at once,
+then appended to a streaming writer, so memory stays flat however many rows
+the input has.
+
+Usage (from Backend/):
+  python run_omr_pipeline_multi.py
+  python run_omr_pipeline_multi.py --responses responses.csv --output scores.parquet --chunksize 200000
+"""
+
+import argparse
 import os
 
+import pandas as pd
+
 # === CONFIGURATION ===
 key_file = os.path.join("sample_data", "answer_keys", "Key(Set A and B).xlsx")
 responses_file = "student_responses.xlsx"
 output_file = "scores.xlsx"
 
+SUBJECT_COLUMNS = ["Python", "EDA", "SQL", "POWER BI", "Statistics"]
+SETS = {"A": "Set - A", "B": "Set - B"}
+CHUNKSIZE = 100_000
+
+
 # === LOAD ANSWER KEYS ===
-answer_key_A = pd.read_excel(key_file, sheet_name="Set - A").iloc[0].to_dict()
-answer_key_B = pd.read_excel(key_file, sheet_name="Set - B").iloc[0].to_dict()
-
-# Map set to answer key and relevant columns
-# ...existing code...
-set_to_key = {
-    "A": (answer_key_A, ["Python", "EDA", "SQL", "POWER BI", "Statistics"]),
-    "B": (answer_key_B, ["Python", "EDA", "SQL", "POWER BI", "Statistics"])
-}
-# ...existing code...
-
-# === LOAD STUDENT RESPONSES ===
-if os.path.exists(responses_file):
-    student_responses = pd.read_excel(responses_file)
-else:
-    print(f"'{responses_file}' not found. Skipping scoring.")
-    student_responses = None
-
-if student_responses is not None:
-    # === SCORING FUNCTION ===
-    def score_student(row):
-        student_set = str(row["Set"]).strip().upper()
-        if student_set not in set_to_key:
-            return 0  # or handle as needed
-        key_dict, columns = set_to_key[student_set]
-        score = 0
-        for col in columns:
-            student_ans = str(row.get(col, "")).strip().lower()
-            correct_ans = str(key_dict.get(col, "")).strip().lower()
-            if student_ans and student_ans == correct_ans:
-                score += 1
-        return score
-
-    # === COMPUTE SCORES ===
-    student_responses["Score"] = student_responses.apply(score_student, axis=1)
-
-    # === SAVE RESULTS ===
-    student_responses.to_excel(output_file, index=False)
-    print(f"Scores saved to {output_file}")
+def load_answer_keys(path, sets=SETS, columns=SUBJECT_COLUMNS):
+    """
+    Read every set's sheet in one pass over the workbook and return a
+    DataFrame indexed by set letter with one normalized key value per column.
+    Columns missing from a set's sheet are left empty (never scored correct).
+    """
+    sheets = pd.read_excel(path, sheet_name=list(sets.values()))
+    rows = {}
+    for set_name, sheet_name in sets.items():
+        first = sheets[sheet_name].iloc[0]
+        rows[set_name] = [first.get(col) for col in columns]
+    keys = pd.DataFrame.from_dict(rows, orient="index", columns=columns)
+    return keys.apply(_normalize)
+
+
+def _normalize(values):
+    # strip + lowercase, with missing / blank cells as NA
+    out = values.astype("string").str.strip().str.lower()
+    return out.mask(out == "")
+
+
+# === SCORING ===
+def score_chunk(chunk, keys, columns=SUBJECT_COLUMNS):
+    """
+    Adds a Score column: one point per subject column whose answer equals the
+    key of the row's set. Rows with an unknown set score 0.
+    """
+    student_set = chunk["Set"].astype("string").str.strip().str.upper()
+    score = pd.Series(0, index=chunk.index, dtype="int64")
+    for col in columns:
+        if col not in chunk:
+            continue
+        expected = student_set.map(keys[col])
+        answers = _normalize(chunk[col])
+        score += (answers == expected).fillna(False).astype("int64")
+    chunk["Score"] = score
+    return chunk
+
+
+# === STREAMING READERS ===
+def iter_responses(path, chunksize=CHUNKSIZE):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        yield from pd.read_csv(path, chunksize=chunksize)
+    elif ext in (".parquet", ".pq"):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    elif ext in (".xlsx", ".xlsm"):
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            buf = []
+            for row in rows:
+                buf.append(row)
+                if len(buf) >= chunksize:
+                    yield pd.DataFrame(buf, columns=header)
+                    buf = []
+            if buf:
+                yield pd.DataFrame(buf, columns=header)
+        finally:
+            wb.close()
+    else:
+        raise ValueError(f"Unsupported responses format '{ext}' (use .csv, .parquet or .xlsx)")
+
+
+# === STREAMING WRITERS ===
+class ScoreWriter:
+    """Appends scored chunks to CSV, Parquet or write-only XLSX."""
+
+    def __init__(self, path):
+        self.path = path
+        self.ext = os.path.splitext(path)[1].lower()
+        if self.ext not in (".csv", ".parquet", ".pq", ".xlsx"):
+            raise ValueError(f"Unsupported output format '{self.ext}' (use .csv, .parquet or .xlsx)")
+        self._started = False
+        self._writer = None
+
+    def write(self, chunk):
+        if self.ext == ".csv":
+            chunk.to_csv(self.path, mode="a" if self._started else "w", header=not self._started, index=False)
+        elif self.ext in (".parquet", ".pq"):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            if self._writer is None:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            else:
+                table = pa.Table.from_pandas(chunk, schema=self._writer.schema, preserve_index=False)
+            self._writer.write_table(table)
+        else:
+            if self._writer is None:
+                from openpyxl import Workbook
+                self._writer = Workbook(write_only=True)
+                self._sheet = self._writer.create_sheet()
+                self._sheet.append([str(c) for c in chunk.columns])
+            for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+                self._sheet.append(row)
+        self._started = True
+
+    def close(self):
+        if self.ext in (".parquet", ".pq") and self._writer is not None:
+            self._writer.close()
+        elif self.ext == ".xlsx" and self._writer is not None:
+            self._writer.save(self.path)
+        self._writer = None
+
+
+def run(key_path, responses_path, output_path, chunksize=CHUNKSIZE):
+    keys = load_answer_keys(key_path)
+    writer = ScoreWriter(output_path)
+    rows = 0
+    try:
+        for chunk in iter_responses(responses_path, chunksize):
+            writer.write(score_chunk(chunk, keys))
+            rows += len(chunk)
+    finally:
+        writer.close()
+    return rows
+
+
+def main():
+    p = argparse.ArgumentParser(description="Score student responses against the Set A/B answer keys.")
+    p.add_argument("--key", default=key_file, help="Answer key workbook (default: %(default)s)")
+    p.add_argument("--responses", default=responses_file, help="Responses .csv/.parquet/.xlsx (default: %(default)s)")
+    p.add_argument("--output", default=output_file, help="Scores .csv/.parquet/.xlsx (default: %(default)s)")
+    p.add_argument("--chunksize", type=int, default=CHUNKSIZE, help="Rows per chunk (default: %(default)s)")
+    args = p.parse_args()
+
+    # === LOAD STUDENT RESPONSES ===
+    if not os.path.exists(args.responses):
+        print(f"'{args.responses}' not found. Skipping scoring.")
+        return
+
+    # === COMPUTE + SAVE SCORES ===
+    rows = run(args.key, args.responses, args.output, args.chunksize)
+    print(f"Scores for {rows} students saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# backend/tests/conftest.py
+import json
+import os
+import tempfile
+
+import pytest
+
+# the database engine and upload archiving are configured at import time
+_TMP = tempfile.mkdtemp(prefix="omr_tests_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_TMP, 'omr_results.db')}")
+os.environ.setdefault("OMR_ARCHIVE_UPLOADS", "0")
+
+SAMPLE_IMAGES = os.path.join(os.path.dirname(__file__), os.pardir, "sample_data", "images")
+
+
+def sample_image(name):
+    """Path of a sample photo, e.g. "A/Img1.jpeg"."""
+    return os.path.join(SAMPLE_IMAGES, name)
+
+
+# 100 questions, five sections of 20
+ANSWER_KEYS = {"v1": ["A", "B", "C", "D"] * 25}
+
+
+@pytest.fixture(scope="session")
+def answer_key_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp("keys") / "answer_keys.json"
+    path.write_text(json.dumps(ANSWER_KEYS))
+    return str(path)
+
+
+@pytest.fixture(scope="session")
+def processor(answer_key_path):
+    from Backend.omr.processor import OMRProcessor
+    proc = OMRProcessor(answer_key_path=answer_key_path)
+    yield proc
+    proc.close()
+
+
+@pytest.fixture(scope="session")
+def client(processor):
+    """TestClient for the app, grading with the test processor."""
+    from fastapi.testclient import TestClient
+    from Backend import app as app_module
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(app_module, "processor", processor)
+        with TestClient(app_module.app) as test_client:
+            yield test_client
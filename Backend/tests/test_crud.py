@@ -0,0 +1,22 @@
+# backend/tests/test_crud.py
+from Backend.db import crud
+from Backend.db.database import SessionLocal, init_db
+
+
+def test_get_or_create_exam_loses_the_race_cleanly(monkeypatch):
+    init_db()
+    with SessionLocal() as db, SessionLocal() as other:
+        real_lookup = crud.get_exam_by_code
+        misses = []
+
+        def stale_lookup(session, code):
+            # the first lookup misses; another request inserts the exam meanwhile
+            if not misses:
+                misses.append(code)
+                crud.create_exam(other, {"exam_code": code})
+                return None
+            return real_lookup(session, code)
+
+        monkeypatch.setattr(crud, "get_exam_by_code", stale_lookup)
+        exam = crud.get_or_create_exam(db, "RACE-1")
+        assert exam.id == real_lookup(other, "RACE-1").id
@@ -0,0 +1,23 @@
+# backend/tests/test_item_analysis.py
+from Backend.db import crud
+from Backend.db.database import SessionLocal
+
+from .conftest import ANSWER_KEYS
+
+
+def test_difficulty_is_over_every_sheet_of_the_version(client):
+    with SessionLocal() as db:
+        exam = crud.get_or_create_exam(db, "ITEMS-1")
+        crud.set_answer_key(db, exam.id, "v1", ANSWER_KEYS["v1"])
+        # question 2 was not read on the second sheet
+        crud.create_result(db, {"exam_id": exam.id, "version": "v1", "total_score": 2,
+                                "raw_answers": {"1": "A", "2": "B"}})
+        crud.create_result(db, {"exam_id": exam.id, "version": "v1", "total_score": 1,
+                                "raw_answers": {"1": "A"}})
+    response = client.get("/exams/ITEMS-1/item-analysis")
+    assert response.status_code == 200, response.text
+    version = response.json()["versions"]["v1"]
+    assert version["sheets"] == 2
+    first, second = version["questions"]
+    assert (first["responses"], first["difficulty"]) == (2, 1.0)
+    assert (second["responses"], second["difficulty"]) == (1, 0.5)
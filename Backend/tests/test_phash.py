@@ -0,0 +1,33 @@
+# backend/tests/test_phash.py
+import random
+
+import numpy as np
+
+from Backend.omr.phash import PHashIndex, HASH_BITS, hamming, sheet_phash
+
+
+def test_flat_sheet_has_no_hash():
+    flat = np.full((400, 300), 200, dtype=np.uint8)
+    assert sheet_phash(flat) is None
+    # a few stray pixels are still flat, not a random hash
+    noisy = flat.copy()
+    noisy[::37, ::23] = 190
+    assert sheet_phash(noisy) is None
+
+
+def test_index_is_exact():
+    rnd = random.Random(0)
+    base = [rnd.getrandbits(HASH_BITS) for _ in range(20)]
+    index, hashes = PHashIndex(capacity=8), {}
+    for item_id in range(1, 2001):
+        phash = base[item_id % len(base)]
+        for _ in range(rnd.randint(0, 50)):
+            phash ^= 1 << rnd.randrange(HASH_BITS)
+        hashes[item_id] = phash
+        index.add(item_id, phash)
+    for _ in range(50):
+        query = rnd.choice(list(hashes.values()))
+        max_distance = rnd.choice([0, 10, 35, 60])
+        expected = sorted(((i, hamming(query, h)) for i, h in hashes.items() if hamming(query, h) <= max_distance),
+                          key=lambda m: (m[1], m[0]))
+        assert index.query(query, max_distance) == expected
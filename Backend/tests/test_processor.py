@@ -0,0 +1,48 @@
+# backend/tests/test_processor.py
+import cv2
+import numpy as np
+import pytest
+
+from .conftest import sample_image
+
+
+def _resized(name, max_dim):
+    img = cv2.imread(sample_image(name))
+    scale = max_dim / max(img.shape[:2])
+    return cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+@pytest.mark.parametrize("name", ["A/Img1.jpeg", "A/Img4.jpeg", "B/Img10.jpeg"])
+def test_sheet_found_with_and_without_pyramid(processor, name):
+    # 1000px is searched at full resolution, 1100px on a pyrDown level
+    # (detect_max_dim 1024); the sheet must be found the same way at both
+    corners, answered = [], []
+    for max_dim in (1000, 1100):
+        img = _resized(name, max_dim)
+        corners.append(processor._order_points(processor._detect_sheet(img)) / max_dim)
+        result = processor.process_image(img, "v1")
+        answered.append(sum(option is not None for option in result["answers"].values()))
+    assert np.abs(corners[0] - corners[1]).max() < 0.01
+    assert min(answered) >= 70
+    assert abs(answered[0] - answered[1]) <= 2
+
+
+def _contour_bubbles(thresh):
+    # the per-contour loop _find_bubbles replaced
+    contours, _ = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = []
+    for c in contours:
+        x, y, w, h = cv2.boundingRect(c)
+        ar = w / float(h) if h != 0 else 0
+        if 15 < w < 100 and 15 < h < 100 and 0.7 <= ar <= 1.3 and cv2.contourArea(c) > 100:
+            boxes.append((x, y, w, h))
+    return sorted(boxes, key=lambda b: (b[1], b[0]))
+
+
+@pytest.mark.parametrize("name", ["A/Img1.jpeg", "A/Img8.jpeg", "A/Img20.jpeg", "B/Img11.jpeg", "B/Img22.jpeg"])
+def test_find_bubbles_matches_contour_path(processor, name):
+    img = cv2.imread(sample_image(name))
+    warped = processor._four_point_transform(img, processor._detect_sheet(img), max_dim=2000)
+    thresh = processor._threshold(cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY))
+    found = [tuple(box) for box in processor._find_bubbles(thresh).tolist()]
+    assert found == _contour_bubbles(thresh)
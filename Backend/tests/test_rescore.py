@@ -0,0 +1,38 @@
+# backend/tests/test_rescore.py
+from collections import Counter
+
+from .conftest import ANSWER_KEYS, sample_image
+
+
+def _evaluate(client, name, exam_code, student_id):
+    with open(sample_image(name), "rb") as f:
+        response = client.post("/evaluate", files={"file": (name.split("/")[-1], f, "image/jpeg")},
+                               data={"version": "v1", "exam_code": exam_code, "student_id": student_id})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _total(answers, key):
+    # single-letter answers and keys: right when the letters match
+    return sum(1 for q, option in answers.items() if option is not None and option == key[int(q) - 1])
+
+
+def test_sheets_graded_after_a_rescore_use_the_corrected_key(client):
+    first = _evaluate(client, "A/Img1.jpeg", "RESCORE-1", "rescore-1")
+    # the corrected key accepts every answer of the first sheet
+    key = list(ANSWER_KEYS["v1"])
+    for q, option in first["answers"].items():
+        if option is not None:
+            key[int(q) - 1] = option
+    response = client.post("/exams/RESCORE-1/rescore", json={"version": "v1", "key": key})
+    assert response.status_code == 200, response.text
+    assert client.get("/result/rescore-1").json()["total_score"] == _total(first["answers"], key)
+
+    later = _evaluate(client, "A/Img2.jpeg", "RESCORE-1", "rescore-2")
+    expected = _total(later["answers"], key)
+    assert expected != _total(later["answers"], ANSWER_KEYS["v1"])
+    assert later["total_score"] == expected
+    assert client.get("/result/rescore-2").json()["total_score"] == expected
+
+    histogram = client.get("/exams/RESCORE-1/ranking").json()["histogram"]
+    assert {b["score"]: b["count"] for b in histogram} == Counter([_total(first["answers"], key), expected])
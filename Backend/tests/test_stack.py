@@ -0,0 +1,12 @@
+# backend/tests/test_stack.py
+
+
+def test_stack_rejects_bad_input_before_streaming(client):
+    response = client.post("/evaluate/stack", files={"file": ("stack.pdf", b"PK\x03\x04 not a pdf", "application/pdf")},
+                           data={"version": "v1"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Not a PDF file"
+
+    response = client.post("/evaluate/stack", files={"file": ("stack.pdf", b"%PDF-1.4", "application/pdf")},
+                           data={"version": "no-such-version"})
+    assert response.status_code == 400